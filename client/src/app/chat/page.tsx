@@ -56,21 +56,35 @@ export default function ChatBot() {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
+      // Server-Sent Events: 空行区切りのイベントごとに data 行のJSONを読む
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
       let aiContent = "";
+      let buffer = "";
       let done = false;
       let firstChunk = true;
       while (!done) {
         const { value, done: doneReading } = await reader.read();
         done = doneReading;
-        if (value) {
+        buffer += decoder.decode(value, { stream: !done });
+        const events = buffer.split("\n\n");
+        buffer = events.pop() ?? "";
+        for (const rawEvent of events) {
+          let eventName = "message";
+          let data = "";
+          for (const line of rawEvent.split("\n")) {
+            if (line.startsWith("event:")) eventName = line.slice(6).trim();
+            else if (line.startsWith("data:")) data += line.slice(5).trim();
+          }
+          if (eventName === "error") {
+            throw new Error(JSON.parse(data).detail);
+          }
+          if (eventName !== "message" || !data) continue;
           if (firstChunk) {
             setIsLoading(false);
             firstChunk = false;
           }
-          const chunk = decoder.decode(value);
-          aiContent += chunk;
+          aiContent += JSON.parse(data).text;
           setMessages((msgs) => {
             const newMsgs = [...msgs];
             if (
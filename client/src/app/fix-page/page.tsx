@@ -85,7 +85,8 @@ ${currentCss}
 上記の現在のページに対して、修正要求に従ってページを修正してください。
 `;
 
-      const response = await fetch(`${BACKEND_URL}/generate-page`, {
+      // 生成はジョブとして登録し、完了するまで状態を確認する
+      const response = await fetch(`${BACKEND_URL}/page-jobs`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -97,7 +98,22 @@ ${currentCss}
         throw new Error(`HTTP error! status: ${response.status}`);
       }
 
-      const pageData: PageData = await response.json();
+      let job = await response.json();
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        const jobResponse = await fetch(
+          `${BACKEND_URL}/page-jobs/${job.job_id}`,
+        );
+        if (!jobResponse.ok) {
+          throw new Error(`HTTP error! status: ${jobResponse.status}`);
+        }
+        job = await jobResponse.json();
+      }
+      if (job.status !== "done") {
+        throw new Error(job.error || "ページ生成に失敗しました");
+      }
+
+      const pageData: PageData = job.result;
       setCurrentPage(pageData);
       applyCSS(pageData.css_content);
 
@@ -22,11 +22,19 @@ interface User {
   login_time: number;
 }
 
+// 1回の検索で取得する件数（続きは「さらに表示」で読み込む）
+const PAGE_SIZE = 50;
+
 export default function SearchSyllabus() {
   const [lectures, setLectures] = useState<Lecture[]>([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [hasSearched, setHasSearched] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [searchParams, setSearchParams] = useState<Record<string, string>>(
+    {}
+  );
+  const [loadingMore, setLoadingMore] = useState(false);
   const [user, setUser] = useState<User | null>(null);
   const [authLoading, setAuthLoading] = useState(true);
   const [modalOpen, setModalOpen] = useState(false);
@@ -80,9 +88,16 @@ export default function SearchSyllabus() {
     keyword: "",
   });
 
-  // 講義データを取得
-  const fetchLectures = async (searchParams: Record<string, string> = {}) => {
-    setLoading(true);
+  // 講義データを1ページ分取得（cursor 指定時は続きを追加）
+  const fetchLectures = async (
+    searchParams: Record<string, string> = {},
+    cursor: string | null = null
+  ) => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     setError(null);
 
     try {
@@ -90,6 +105,8 @@ export default function SearchSyllabus() {
       Object.entries(searchParams).forEach(([key, value]) => {
         if (value) params.append(key, value);
       });
+      params.append("limit", String(PAGE_SIZE));
+      if (cursor) params.append("cursor", cursor);
 
       const response = await fetch(
         `${BACKEND_URL}/lectures?${params.toString()}`
@@ -100,13 +117,15 @@ export default function SearchSyllabus() {
       }
 
       const data = await response.json();
-      setLectures(data);
+      setLectures((prev) => (cursor ? [...prev, ...data.items] : data.items));
+      setNextCursor(data.has_more ? data.next_cursor : null);
     } catch (err) {
       setError(
         err instanceof Error ? err.message : "データの取得に失敗しました"
       );
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -116,9 +135,15 @@ export default function SearchSyllabus() {
       Object.entries(filters).filter(([, value]) => value.trim() !== "")
     );
     setHasSearched(true);
+    setSearchParams(nonEmptyFilters);
     fetchLectures(nonEmptyFilters);
   };
 
+  // 次のページを読み込む
+  const handleLoadMore = () => {
+    if (nextCursor) fetchLectures(searchParams, nextCursor);
+  };
+
   // フィルターリセット
   const handleReset = () => {
     setFilters({
@@ -134,6 +159,8 @@ export default function SearchSyllabus() {
       keyword: "",
     });
     setLectures([]);
+    setNextCursor(null);
+    setSearchParams({});
     setHasSearched(false);
   };
 
@@ -541,7 +568,7 @@ export default function SearchSyllabus() {
               fontSize: "1.5rem",
             }}
           >
-            検索結果 ({lectures.length}件)
+            検索結果 ({lectures.length}件{nextCursor ? "以上" : ""})
           </h2>
 
           {loading && (
@@ -666,6 +693,27 @@ export default function SearchSyllabus() {
               ))}
             </div>
           )}
+
+          {!loading && !error && nextCursor && (
+            <div style={{ textAlign: "center", marginTop: "20px" }}>
+              <button
+                onClick={handleLoadMore}
+                disabled={loadingMore}
+                style={{
+                  background: "#1e3c72",
+                  color: "white",
+                  border: "none",
+                  padding: "12px 25px",
+                  borderRadius: "5px",
+                  cursor: loadingMore ? "default" : "pointer",
+                  fontSize: "14px",
+                  opacity: loadingMore ? 0.6 : 1,
+                }}
+              >
+                {loadingMore ? "読み込み中..." : "さらに表示"}
+              </button>
+            </div>
+          )}
         </div>
       </div>
 
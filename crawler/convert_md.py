@@ -126,6 +126,95 @@ def convert_list_to_markdown(list_element, list_type):
     return "\n" + "\n".join(items) + "\n"
 
 
+def split_markdown_chunks(markdown_text, max_chars=1000):
+    """html_to_markdownの出力を見出し・表の単位でチャンクに分割する
+
+    見出しごとに区切り、その中でも表と本文は別チャンクにする。
+    max_chars を超える表は行単位（ヘッダー行を繰り返す）、本文は段落単位で分割する。
+    戻り値: [{"heading": 直前の見出し, "text": チャンク本文}, ...]
+    """
+    if pd.isna(markdown_text) or not markdown_text.strip():
+        return []
+
+    # (見出し, 種別, 行リスト) のセグメントに分ける
+    segments = []
+    heading = ""
+    kind = None
+    lines = []
+    for line in markdown_text.split("\n"):
+        stripped = line.strip()
+        heading_match = re.match(r"^#{1,6}\s+(.*)$", stripped)
+        if heading_match:
+            segments.append((heading, kind, lines))
+            heading = heading_match.group(1).strip()
+            kind = None
+            lines = []
+            continue
+        if not stripped:
+            if kind == "text":
+                lines.append("")
+            continue
+        line_kind = "table" if stripped.startswith("|") else "text"
+        if kind is not None and line_kind != kind:
+            segments.append((heading, kind, lines))
+            lines = []
+        kind = line_kind
+        lines.append(stripped)
+    segments.append((heading, kind, lines))
+
+    chunks = []
+    for heading, kind, lines in segments:
+        if not any(lines):
+            continue
+        if kind == "table":
+            pieces = _split_table_lines(lines, max_chars)
+        else:
+            pieces = _split_text_lines(lines, max_chars)
+        for piece in pieces:
+            if piece.strip():
+                chunks.append({"heading": heading, "text": piece.strip()})
+    return chunks
+
+
+def _split_table_lines(lines, max_chars):
+    """表を行単位で分割（各チャンクの先頭にヘッダー行と区切り行を付ける）"""
+    if len(lines) >= 2 and re.match(r"^\|[\s\-|:]+\|$", lines[1]):
+        header, body = lines[:2], lines[2:]
+    else:
+        header, body = [], lines
+    pieces = []
+    current = list(header)
+    for row in body:
+        if len(current) > len(header) and len("\n".join(current + [row])) > max_chars:
+            pieces.append("\n".join(current))
+            current = list(header)
+        current.append(row)
+    if len(current) > len(header) or not pieces:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def _split_text_lines(lines, max_chars):
+    """本文を段落単位で分割（1段落が長すぎる場合は文字数で切る）"""
+    paragraphs = [p.strip() for p in "\n".join(lines).split("\n\n") if p.strip()]
+    pieces = []
+    current = ""
+    for paragraph in paragraphs:
+        while len(paragraph) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + 2 + len(paragraph) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
 def main():
     # CSVファイルを読み込み
     print("CSVファイルを読み込み中...")
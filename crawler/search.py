@@ -2,6 +2,7 @@ import requests
 import numpy as np
 from typing import List, Dict, Optional
 from ..backend.database import get_db_connection
+from ..backend.vector_index import get_syllabus_index
 import os
 
 # Cohere API設定
@@ -52,11 +53,6 @@ def get_query_embedding(query: str) -> Optional[np.ndarray]:
         return None
 
 
-def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
-    """コサイン類似度を計算"""
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-
 def search_syllabuses(query: str, top_k: int = 3) -> List[Dict]:
     """シラバスをベクトル検索"""
     print(f"検索クエリ: {query}")
@@ -69,38 +65,36 @@ def search_syllabuses(query: str, top_k: int = 3) -> List[Dict]:
 
     print(f"クエリベクトル化完了: {len(query_vector)}次元")
 
-    # データベースから全てのシラバスを取得
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, code, md, vector FROM syllabuses")
-        rows = cursor.fetchall()
-
-    if not rows:
+    # ベクトル索引（件数が多い場合はIVF近似索引）で上位k件を取得
+    index = get_syllabus_index()
+    hits = index.search(query_vector, top_k=top_k)
+    if not hits:
         print("データベースにシラバスがありません")
         return []
 
-    print(f"データベースから{len(rows)}件のシラバスを取得")
-
-    # 類似度を計算
-    results = []
-    for row in rows:
-        syllabus_id, code, md, vector_bytes = row
+    print(f"索引の{len(index)}件からシラバスを検索")
 
-        # ベクトルを復元
-        syllabus_vector = np.frombuffer(vector_bytes, dtype=np.float32)
-
-        # コサイン類似度を計算
-        similarity = cosine_similarity(query_vector, syllabus_vector)
-
-        results.append(
-            {"id": syllabus_id, "code": code, "md": md, "similarity": similarity}
+    # 上位k件のmdのみを取得
+    ids = [hit["id"] for hit in hits]
+    placeholders = ",".join("?" * len(ids))
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT id, md FROM syllabuses WHERE id IN ({placeholders})", ids
         )
-
-    # 類似度でソート（降順）
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-
-    # 上位k件を返す
-    return results[:top_k]
+        md_by_id = {row[0]: row[1] for row in cursor.fetchall()}
+
+    results = [
+        {
+            "id": hit["id"],
+            "code": hit["code"],
+            "md": md_by_id.get(hit["id"], ""),
+            "similarity": hit["similarity"],
+        }
+        for hit in hits
+    ]
+
+    return results
 
 
 def demo():
@@ -3,7 +3,7 @@ import requests
 import numpy as np
 import os
 import time
-from typing import Optional
+from typing import List, Optional
 
 
 from database import get_db_connection
@@ -75,6 +75,112 @@ def get_embedding(text: str) -> Optional[bytes]:
         return None
 
 
+def get_embeddings(texts: List[str]) -> Optional[List[bytes]]:
+    """複数テキストを1回のAPI呼び出しでベクトル化してバイトデータのリストで返す"""
+    try:
+        resp = requests.post(
+            COHERE_API_URL,
+            headers={
+                "Authorization": f"Bearer {COHERE_API_KEY}",
+                "Content-Type": "application/json",
+            },
+            json={
+                "model": "embed-multilingual-v3.0",
+                "input_type": "search_document",
+                "texts": texts,
+                "truncate": "END",
+            },
+            timeout=60,
+        )
+
+        if resp.status_code == 429:
+            print("レート制限に達しました。60秒待機します...")
+            time.sleep(60)
+            return None
+
+        if resp.status_code != 200:
+            print(f"APIエラー: {resp.status_code} - {resp.text}")
+            return None
+
+        data = resp.json()
+        if "embeddings" in data:
+            embeddings = data["embeddings"]
+            vectors = embeddings["float"] if "float" in embeddings else embeddings
+        elif "embeddings_by_type" in data:
+            embeddings_by_type = data["embeddings_by_type"]
+            vectors = embeddings_by_type[list(embeddings_by_type.keys())[0]]
+        else:
+            print(f"予期しないレスポンス構造: {data}")
+            return None
+        return [np.array(v, dtype=np.float32).tobytes() for v in vectors]
+
+    except Exception as e:
+        print(f"ベクトル化エラー詳細: {e}")
+        return None
+
+
+def import_syllabus_chunks(
+    max_chars: int = 1000, batch_size: int = 96, missing_only: bool = False
+):
+    """syllabusesのmdを見出し・表単位に分割し、チャンクごとのベクトルを保存
+
+    missing_only: True の場合はチャンクの無いシラバスのみ処理する
+        （md の更新でトリガーがチャンクを削除したシラバスの作り直しに使う）
+    """
+    from convert_md import split_markdown_chunks
+    from database import replace_syllabus_chunks
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if missing_only:
+            cursor.execute("""
+                SELECT id, code, md FROM syllabuses
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM syllabus_chunks WHERE syllabus_id = syllabuses.id
+                )
+                ORDER BY id
+            """)
+        else:
+            cursor.execute("SELECT id, code, md FROM syllabuses ORDER BY id")
+        syllabuses = cursor.fetchall()
+
+    total_chunks = 0
+    for count, (syllabus_id, code, md) in enumerate(syllabuses, start=1):
+        chunks = split_markdown_chunks(md, max_chars=max_chars)
+        if not chunks:
+            continue
+
+        # 見出しを含めてベクトル化（Cohereは1リクエスト最大96件）
+        texts = [
+            f"{c['heading']}\n{c['text']}" if c["heading"] else c["text"]
+            for c in chunks
+        ]
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start : start + batch_size]
+            for retry in range(3):
+                result = get_embeddings(batch)
+                if result is not None:
+                    break
+            if result is None:
+                print(f"{code}: チャンクのベクトル化に失敗しました")
+                break
+            vectors.extend(result)
+        if len(vectors) != len(chunks):
+            continue
+
+        for chunk, vector in zip(chunks, vectors):
+            chunk["vector"] = vector
+        total_chunks += replace_syllabus_chunks(syllabus_id, code, chunks)
+
+        if count % 100 == 0:
+            print(
+                f"チャンク処理中: {count}/{len(syllabuses)}件 ({total_chunks}チャンク)"
+            )
+
+    print(f"チャンク作成完了: {total_chunks}チャンク")
+
+
 def import_syllabuses_from_csv(
     csv_path: str, batch_size: int = 10, max_rows: int = None
 ):
@@ -185,6 +291,23 @@ def main():
     import_syllabuses_from_csv(csv_path)
     print("インポートが完了しました。")
 
+    print("シラバスのチャンク分割とベクトル化を開始します...")
+    import_syllabus_chunks()
+
+    # サーバーがmemmapで共有できるようにベクトルを書き出す
+    from vector_index import get_chunk_index, get_syllabus_index
+
+    count = get_syllabus_index().export()
+    print(f"{count}件のベクトルを書き出しました")
+    count = get_chunk_index().export()
+    print(f"{count}件のチャンクベクトルを書き出しました")
+
+    # チャット用の文脈ブロック（講義ヘッダ + md）を事前構築
+    from rag_context import rebuild_context_blocks
+
+    count = rebuild_context_blocks(force=True)
+    print(f"{count}件の文脈ブロックを構築しました")
+
     # データベースの内容を確認
     print("\n=== データベースの内容確認 ===")
     with get_db_connection() as conn:
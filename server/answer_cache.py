@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+import time
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from database import get_catalog_version, get_db_connection
+
+# キャッシュ設定
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true") == "true"
+# 質問埋め込みのコサイン類似度がこの値以上なら同じ質問とみなす
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# 保持する回答の最大件数（超えた分は最終利用が古い順に削除）
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+# 有効期限（秒）
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+
+
+def codes_key(codes: Iterable[str]) -> str:
+    """検索で得た科目コード集合のキー（順序に依存しない）"""
+    joined = "\n".join(sorted(set(codes)))
+    return hashlib.sha256(joined.encode("utf-8")).hexdigest()
+
+
+# ========================
+#  意味的回答キャッシュ
+# ========================
+class SemanticAnswerCache:
+    """質問埋め込みが十分近く、検索結果の科目コード集合が同一なら保存済みの回答を返す
+
+    回答は SQLite の answer_cache テーブルに保存し、ワーカー間・CGIプロセス間で共有する。
+    科目コード集合のキーで候補を絞ってから類似度を計算するため、比較対象は少数で済む。
+    講義・シラバスのテーブルが更新されると（カタログバージョンが変わると）古い回答は使わない。
+    ヒット時は読み取りのみで返し、最終利用時刻はメモリに溜めて次の put でまとめて書き込む
+    （他の書き込み中でもヒットがロック待ちで失敗しないようにする）。
+    """
+
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        ttl: float = ANSWER_CACHE_TTL,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._table_ready = False
+        # 未反映の最終利用時刻（id → 時刻）
+        self._touched: Dict[int, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _ensure_table(self, conn):
+        if self._table_ready:
+            return
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codes_key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                catalog_version TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_answer_cache_codes ON answer_cache(codes_key)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used ON answer_cache(last_used_at)"
+        )
+        conn.commit()
+        self._table_ready = True
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def get(self, vector: List[float], codes: Iterable[str]) -> Optional[str]:
+        """類似した質問の回答を返す（無い・期限切れ・カタログ更新済みならNone）"""
+        query = self._normalize(vector)
+        if query is None:
+            return None
+        now = time.time()
+        with get_db_connection() as conn:
+            self._ensure_table(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, vector, answer FROM answer_cache
+                WHERE codes_key = ? AND catalog_version = ? AND created_at >= ?
+                """,
+                (codes_key(codes), get_catalog_version(), now - self.ttl),
+            )
+            best = None
+            best_similarity = self.threshold
+            for row in cursor.fetchall():
+                stored = np.frombuffer(row["vector"], dtype=np.float32)
+                if stored.shape != query.shape:
+                    continue
+                similarity = float(stored @ query)
+                if similarity >= best_similarity:
+                    best, best_similarity = row, similarity
+        if best is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self._touched[best["id"]] = now
+            self.hits += 1
+        return best["answer"]
+
+    def put(self, vector: List[float], codes: Iterable[str], answer: str):
+        """回答を保存し、古いカタログの回答と件数上限を超えた分を削除"""
+        query = self._normalize(vector)
+        if query is None or not answer:
+            return
+        now = time.time()
+        catalog_version = get_catalog_version()
+        with get_db_connection() as conn:
+            self._ensure_table(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM answer_cache WHERE catalog_version != ?",
+                (catalog_version,),
+            )
+            invalidated = cursor.rowcount
+            cursor.execute(
+                """
+                INSERT INTO answer_cache
+                    (codes_key, vector, answer, catalog_version, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (codes_key(codes), query.tobytes(), answer, catalog_version, now, now),
+            )
+            # ヒット時の最終利用時刻を、件数上限による削除の前に反映する
+            with self._lock:
+                touched, self._touched = self._touched, {}
+            cursor.executemany(
+                "UPDATE answer_cache SET last_used_at = ? WHERE id = ?",
+                [(used_at, entry_id) for entry_id, used_at in touched.items()],
+            )
+            cursor.execute(
+                "DELETE FROM answer_cache WHERE created_at < ?", (now - self.ttl,)
+            )
+            evicted = cursor.rowcount
+            cursor.execute("SELECT COUNT(*) FROM answer_cache")
+            overflow = cursor.fetchone()[0] - self.max_entries
+            if overflow > 0:
+                cursor.execute(
+                    """
+                    DELETE FROM answer_cache WHERE id IN (
+                        SELECT id FROM answer_cache ORDER BY last_used_at LIMIT ?
+                    )
+                    """,
+                    (overflow,),
+                )
+                evicted += cursor.rowcount
+            conn.commit()
+        with self._lock:
+            self.stores += 1
+            self.invalidations += invalidated
+            self.evictions += evicted
+
+    def stats(self) -> Dict[str, float]:
+        """ヒット率などの統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "pending_touches": len(self._touched),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
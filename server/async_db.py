@@ -0,0 +1,50 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+# SQLite処理を実行するスレッド数
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # 終了処理で止めた後も同じプロセスで再び使えるよう、必要になった時点で作る
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="sqlite"
+            )
+        return _executor
+
+
+# ========================
+#  非同期DBファサード
+# ========================
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """同期のDB処理を専用スレッドプールで実行して結果を待つ
+
+    database.py などの sqlite3 を使う関数をイベントループ上で直接呼ぶと、
+    重いクエリの間は同じワーカーの他のリクエストが止まるため、async な経路では
+    必ずこの関数を通して呼ぶ。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(fn, *args, **kwargs)
+    )
+
+
+def shutdown_db_executor():
+    """アプリ終了時に実行中のDB処理を待ってスレッドを止める（次の run_db で作り直す）"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
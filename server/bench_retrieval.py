@@ -0,0 +1,149 @@
+"""シラバス検索のベンチマーク
+
+従来方式（全行の code/md/vector を読み出して Python で類似度計算し、
+上位k件ごとに講義情報を問い合わせる）と、2段階方式（ベクトル索引でスコア計算 →
+上位k件の md・講義情報を IN (...) 1回で取得）を比較する。
+SQL回数と読み出しバイト数は、両方式ともスレッドごとの接続に仕掛けたフックで数える
+（set_trace_callback で実行文、row_factory で取得した行の値のバイト数）。
+
+使い方: python bench_retrieval.py [クエリ数] [top_k]
+"""
+
+import math
+import sqlite3
+import struct
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+from database import get_db_connection
+from service import search_similar_syllabuses
+from vector_index import get_syllabus_index
+
+
+def _value_bytes(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bytes):
+        return len(value)
+    return 8
+
+
+@contextmanager
+def count_db_io():
+    """この間にスレッドの接続で実行したSQL文の数と、取得した行の値のバイト数を数える"""
+    counts = {"statements": 0, "bytes": 0}
+
+    def trace(statement):
+        counts["statements"] += 1
+
+    def row_factory(cursor, row):
+        counts["bytes"] += sum(_value_bytes(value) for value in row)
+        return sqlite3.Row(cursor, row)
+
+    with get_db_connection() as conn:
+        conn.set_trace_callback(trace)
+        conn.row_factory = row_factory
+        try:
+            yield counts
+        finally:
+            conn.set_trace_callback(None)
+            conn.row_factory = sqlite3.Row
+
+
+def legacy_search(query_vector, top_k: int = 10):
+    """従来方式の検索"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT code, md, vector FROM syllabuses")
+        rows = cursor.fetchall()
+    results = []
+    for code, md, vector_bytes in rows:
+        count = len(vector_bytes) // 4
+        vector = list(struct.unpack(f"{count}f", vector_bytes))
+        dot = sum(x * y for x, y in zip(query_vector, vector))
+        norm_a = math.sqrt(sum(x * x for x in query_vector))
+        norm_b = math.sqrt(sum(y * y for y in vector))
+        similarity = dot / (norm_a * norm_b) if norm_a > 0 and norm_b > 0 else 0.0
+        results.append({"code": code, "md": md, "similarity": similarity})
+    results.sort(key=lambda x: x["similarity"], reverse=True)
+    results = results[:top_k]
+
+    # 上位k件ごとの講義情報取得（N+1）
+    for row in results:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT name, lecturer, grade, class_name, time FROM lectures WHERE code = ? LIMIT 1",
+                (row["code"],),
+            )
+            cursor.fetchone()
+    return results
+
+
+def two_phase_search(query_vector, top_k: int = 10):
+    """2段階方式の検索"""
+    return search_similar_syllabuses(query_vector, top_k=top_k)
+
+
+def measure(search, queries, top_k: int):
+    elapsed = 0.0
+    peak = 0
+    total_bytes = 0
+    total_statements = 0
+    for query in queries:
+        tracemalloc.start()
+        with count_db_io() as counts:
+            start = time.perf_counter()
+            search(query, top_k)
+            elapsed += time.perf_counter() - start
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        total_bytes += counts["bytes"]
+        total_statements += counts["statements"]
+    n = len(queries)
+    return {
+        "ms/query": elapsed / n * 1000,
+        "peak_alloc_kb": peak / 1024,
+        "db_bytes/query": total_bytes / n,
+        "sql/query": total_statements / n,
+    }
+
+
+def main():
+    n_queries = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    top_k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    index = get_syllabus_index()
+    index.refresh()
+    if len(index) == 0:
+        print("syllabuses にベクトルがありません")
+        return
+
+    # 登録済みベクトルにノイズを加えたものをクエリにする
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT vector FROM syllabuses WHERE vector IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+            (n_queries,),
+        )
+        base = [np.frombuffer(row[0], dtype=np.float32) for row in cursor.fetchall()]
+    rng = np.random.default_rng(0)
+    queries = [(v + rng.normal(scale=0.01, size=v.shape)).tolist() for v in base]
+
+    print(f"シラバス{len(index)}件 / クエリ{len(queries)}件 / top_k={top_k}")
+    for name, search in (("従来方式", legacy_search), ("2段階方式", two_phase_search)):
+        stats = measure(search, queries, top_k)
+        print(
+            f"{name}: {stats['ms/query']:.1f} ms/クエリ, "
+            f"最大割り当て {stats['peak_alloc_kb']:.0f} KB, "
+            f"DB読み出し {stats['db_bytes/query'] / 1024:.0f} KB/クエリ, "
+            f"SQL {stats['sql/query']:.1f} 回/クエリ"
+        )
+
+
+if __name__ == "__main__":
+    main()
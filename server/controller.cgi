@@ -13,6 +13,10 @@ from service import (
     get_syllabus_html_service,
     generate_page_with_ai,
     get_available_lectures_service,
+    search_similar_batch,
+    stream_lectures_service,
+    stream_users_service,
+    NDJSON_MEDIA_TYPE,
 )
 from database import (
     get_or_create_user,
@@ -21,8 +25,10 @@ from database import (
     delete_timetable_entry,
     get_all_users,
     get_user_by_id,
+    ensure_schema,
 )
 import inspect
+from fastapi import HTTPException
 
 
 def print_json(obj, status=200):
@@ -32,6 +38,20 @@ def print_json(obj, status=200):
     print(json.dumps(obj, ensure_ascii=False))
 
 
+def print_ndjson(lines, status=200):
+    """NDJSONの各行を読み出した順に書き出す"""
+    print(f"Content-Type: {NDJSON_MEDIA_TYPE}")
+    print(f"Status: {status}")
+    print(flush=True)
+    for line in lines:
+        sys.stdout.write(line)
+    sys.stdout.flush()
+
+
+def wants_ndjson():
+    return NDJSON_MEDIA_TYPE in os.environ.get("HTTP_ACCEPT", "")
+
+
 def print_text(text, status=200):
     print("Content-Type: text/plain; charset=utf-8")
     print(f"Status: {status}")
@@ -268,6 +288,9 @@ def handle_get_timetable(user_id):
 
 def handle_get_users():
     """全ユーザーの一覧を取得"""
+    if wants_ndjson():
+        print_ndjson(stream_users_service())
+        return
     users = get_all_users()
     print_json(users)
 
@@ -355,6 +378,9 @@ def main():
             print()
             return
 
+        # FastAPI と違い起動時の init_database が無いため、索引・派生テーブルをここで揃える
+        ensure_schema()
+
         # 認証関連のエンドポイント
         if path == "/auth" and method == "GET":
             action = query.get("action", "check")
@@ -409,8 +435,13 @@ def main():
             sig = inspect.signature(get_lectures_service)
             allowed_keys = set(sig.parameters.keys())
             filtered_query = {k: v for k, v in query.items() if k in allowed_keys}
-            result = get_lectures_service(**filtered_query)
-            print_json(result)
+            if wants_ndjson():
+                filtered_query.pop("limit", None)
+                filtered_query.pop("cursor", None)
+                print_ndjson(stream_lectures_service(**filtered_query))
+            else:
+                result = get_lectures_service(**filtered_query)
+                print_json(result)
         elif path == "/available-lectures" and method == "GET":
             day = query.get("day")
             period = query.get("period")
@@ -426,20 +457,57 @@ def main():
             data = json.loads(body)
             result = asyncio.run(generate_page_with_ai(data["prompt"]))
             print_json(result)
+        elif path == "/page-jobs" and method == "POST":
+            from page_jobs import spawn_detached_runner, submit_job
+
+            content_length = int(os.environ.get("CONTENT_LENGTH", 0))
+            body = sys.stdin.read(content_length)
+            data = json.loads(body)
+            job, cached = submit_job(data.get("prompt", ""))
+            if not cached:
+                # 生成は切り離したプロセスで行い、このプロセスはすぐ応答する
+                spawn_detached_runner()
+            print_json({**job, "cached": cached}, 202)
+        elif path.startswith("/page-jobs/") and method == "GET":
+            from page_jobs import get_job
+
+            job = get_job(path.split("/")[-1])
+            if job is None:
+                print_json({"error": "ジョブが見つかりません"}, 404)
+            else:
+                print_json(job)
+        elif path == "/search/similar" and method == "POST":
+            content_length = int(os.environ.get("CONTENT_LENGTH", 0))
+            body = sys.stdin.read(content_length)
+            data = json.loads(body)
+            results = asyncio.run(
+                search_similar_batch(
+                    texts=data.get("texts"),
+                    codes=data.get("codes"),
+                    top_k=int(data.get("top_k", 10)),
+                    filters=data.get("filters"),
+                )
+            )
+            print_json({"results": results})
         elif path == "/chat" and method == "POST":
-            print("Content-Type: text/plain; charset=utf-8\n")
             content_length = int(os.environ.get("CONTENT_LENGTH", 0))
             body = sys.stdin.read(content_length)
             data = json.loads(body)
-            from service import chat_service_stream
+            from service import chat_service_stream, sse_events
+
+            print("Content-Type: text/event-stream; charset=utf-8")
+            print("Cache-Control: no-cache")
+            print("X-Accel-Buffering: no\n", flush=True)
 
             async def stream():
-                async for chunk in chat_service_stream(data):
-                    print(chunk, end="", flush=True)
+                async for event in sse_events(chat_service_stream(data)):
+                    print(event, end="", flush=True)
 
             asyncio.run(stream())
         else:
             print_json({"error": "Not Found"}, 404)
+    except HTTPException as e:
+        print_json({"error": e.detail}, e.status_code)
     except Exception as e:
         print_json({"error": str(e)}, 500)
 
@@ -1,6 +1,10 @@
 import sqlite3
 import os
-from typing import List, Dict, Optional
+import json
+import re
+import threading
+import unicodedata
+from typing import Iterator, List, Dict, Optional
 from contextlib import contextmanager
 
 # データベースファイルのパス
@@ -9,14 +13,174 @@ DB_PATH = "./data/lectures.db"
 # データディレクトリを作成
 os.makedirs("./data", exist_ok=True)
 
+# 更新回数をtable_versionsで追跡するテーブル
+VERSIONED_TABLES = ("lectures", "syllabuses", "syllabus_chunks")
+
+# スキーマのバージョン（init_database でテーブル・索引・トリガーを変えたら上げる）
+SCHEMA_VERSION = 2
+
+# 講義検索（部分一致）の対象列。lectures_fts にも同じ列を索引する
+LECTURE_TEXT_COLUMNS = (
+    "title",
+    "category",
+    "code",
+    "name",
+    "lecturer",
+    "grade",
+    "class_name",
+    "season",
+    "time",
+)
+
+# 接続の設定
+# ロック待ちの上限（ミリ秒）。書き込み役の順番待ちにも同じ上限を使う
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+# メモリマップで読むサイズ（バイト）
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+# ページキャッシュのサイズ（KiB）
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))
+# 接続ごとにキャッシュするプリペアドステートメント数
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+
+# ========================
+#  接続管理
+# ========================
+# 書き込みはプロセス内で1本ずつ行う（SQLite同士のロック競合・busy待ちを避ける）
+_writer_lock = threading.Lock()
+_local = threading.local()
+
+_WRITE_STATEMENT = re.compile(
+    r"^\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER|"
+    r"BEGIN\s+(IMMEDIATE|EXCLUSIVE))\b",
+    re.IGNORECASE,
+)
+
+
+class _Cursor(sqlite3.Cursor):
+    """書き込み文の実行前に書き込み役のロックを取るカーソル"""
+
+    def execute(self, sql, *args):
+        self.connection._before(sql)
+        return super().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        self.connection._before(sql)
+        return super().executemany(sql, *args)
+
+    def executescript(self, sql):
+        self.connection._acquire_writer()
+        return super().executescript(sql)
+
+
+class _Connection(sqlite3.Connection):
+    """スレッドごとに使い回す接続
+
+    書き込み文を実行してから commit / rollback するまで書き込み役のロックを持つ。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.holds_writer = False
+        self.depth = 0
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or _Cursor)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def executescript(self, sql):
+        return self.cursor().executescript(sql)
+
+    def _before(self, sql: str):
+        if not self.holds_writer and _WRITE_STATEMENT.match(sql):
+            self._acquire_writer()
+
+    def _acquire_writer(self):
+        if self.holds_writer:
+            return
+        if not _writer_lock.acquire(timeout=DB_BUSY_TIMEOUT_MS / 1000):
+            raise sqlite3.OperationalError("database is locked")
+        self.holds_writer = True
+
+    def _release_writer(self):
+        if self.holds_writer:
+            self.holds_writer = False
+            _writer_lock.release()
+
+    def commit(self):
+        try:
+            super().commit()
+        finally:
+            self._release_writer()
+
+    def rollback(self):
+        try:
+            super().rollback()
+        finally:
+            self._release_writer()
+
+
+def _connect(path: str, **kwargs) -> _Connection:
+    conn = sqlite3.connect(
+        path, factory=_Connection, cached_statements=DB_STATEMENT_CACHE, **kwargs
+    )
+    conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能にする
+    conn.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    # WALでは NORMAL でも破損はせず、電源断時に直近のコミットが失われうるのみ
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = {-DB_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
 
 @contextmanager
 def get_db_connection():
-    """データベース接続のコンテキストマネージャー"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row  # 辞書形式でアクセス可能にする
+    """データベース接続のコンテキストマネージャー
+
+    接続はスレッドごとに1本を使い回す（入れ子で呼んでも同じ接続）。
+    最も外側を抜ける時点で未コミットの変更があれば、従来の close() と同じく
+    ロールバックする。
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(DB_PATH)
+    if conn is None:
+        conn = connections[DB_PATH] = _connect(DB_PATH)
+    conn.depth += 1
     try:
         yield conn
+    finally:
+        conn.depth -= 1
+        if conn.depth == 0:
+            if conn.in_transaction:
+                conn.rollback()
+            conn._release_writer()
+
+
+def iter_query(query: str, params=(), batch_size: int = 500) -> Iterator[Dict]:
+    """クエリ結果を batch_size 件ずつ読みながら1行ずつ辞書で返す（全件をメモリに載せない）
+
+    ストリーミング応答では next() がリクエストごとに別スレッドで呼ばれうるため、
+    スレッドごとの接続ではなく check_same_thread=False の専用接続を開き、
+    読み終わるか途中で閉じられた時点で閉じる。
+    """
+    conn = _connect(DB_PATH, check_same_thread=False)
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
     finally:
         conn.close()
 
@@ -24,82 +188,333 @@ def get_db_connection():
 def init_database():
     """データベースとテーブルを初期化"""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
+        _create_schema(conn.cursor())
+        conn.commit()
+        print("データベースとテーブルが初期化されました")
 
-        # usersテーブルを作成
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uid TEXT UNIQUE NOT NULL,
-                name TEXT NOT NULL,
-                email TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
 
-        # lecturesテーブルを作成
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS lectures (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT,
-                category TEXT,
-                code TEXT,
-                name TEXT,
-                lecturer TEXT,
-                grade TEXT,
-                class_name TEXT,
-                season TEXT,
-                time TEXT
-            )
-        """)
+def ensure_schema():
+    """スキーマが古ければ init_database と同じ作成・移行を行う（出力なし）
 
-        # syllabusesテーブルを作成
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS syllabuses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT,
-                html TEXT,
-                md TEXT,
-                vector BLOB
-            )
-        """)
+    controller.cgi のように起動時に init_database を呼ばない入口用。
+    作成済みなら PRAGMA user_version を読むだけで終わる。
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        # 同時に起動した他のプロセスと二重に移行しないよう、書き込みロックを取って確認し直す
+        cursor.execute("BEGIN IMMEDIATE")
+        if cursor.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            _create_schema(cursor)
+        conn.commit()
 
-        # lecture_timetablesテーブルを作成（中間テーブル方式）
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS lecture_timetables (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                day_of_week INTEGER NOT NULL,
-                period INTEGER NOT NULL,
-                lecture_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                FOREIGN KEY (lecture_id) REFERENCES lectures(id),
-                UNIQUE(user_id, day_of_week, period)
-            )
-        """)
 
-        # 検索用のインデックスを作成
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_uid ON users(uid)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_title ON lectures(title)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_category ON lectures(category)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_code ON lectures(code)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_name ON lectures(name)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_lecturer ON lectures(lecturer)")
-        cursor.execute(
-            "CREATE INDEX IF NOT EXISTS idx_timetable_user ON lecture_timetables(user_id)"
+def _create_schema(cursor):
+    # usersテーブルを作成
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            uid TEXT UNIQUE NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
-        cursor.execute(
-            "CREATE INDEX IF NOT EXISTS idx_timetable_day_period ON lecture_timetables(day_of_week, period)"
+    """)
+
+    # lecturesテーブルを作成
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lectures (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            category TEXT,
+            code TEXT,
+            name TEXT,
+            lecturer TEXT,
+            grade TEXT,
+            class_name TEXT,
+            season TEXT,
+            time TEXT
         )
-        cursor.execute(
-            "CREATE INDEX IF NOT EXISTS idx_timetable_lecture ON lecture_timetables(lecture_id)"
+    """)
+
+    # syllabusesテーブルを作成
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS syllabuses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT,
+            html TEXT,
+            md TEXT,
+            vector BLOB
         )
+    """)
+
+    # syllabus_chunksテーブルを作成（見出し・表単位のチャンクとベクトル）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS syllabus_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            syllabus_id INTEGER NOT NULL,
+            code TEXT,
+            chunk_index INTEGER NOT NULL,
+            heading TEXT,
+            text TEXT NOT NULL,
+            vector BLOB,
+            FOREIGN KEY (syllabus_id) REFERENCES syllabuses(id)
+        )
+    """)
+    # シラバスの削除・更新にチャンクを追従させる
+    # md が変わったチャンクは古い本文のため削除する。作り直すには
+    # crawler/vector.py の import_syllabus_chunks(missing_only=True) を実行する
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_syllabus_chunks_delete
+        AFTER DELETE ON syllabuses
+        BEGIN
+            DELETE FROM syllabus_chunks WHERE syllabus_id = old.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_syllabus_chunks_md_update
+        AFTER UPDATE OF md ON syllabuses
+        WHEN old.md IS NOT new.md
+        BEGIN
+            DELETE FROM syllabus_chunks WHERE syllabus_id = old.id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_syllabus_chunks_code_update
+        AFTER UPDATE OF code ON syllabuses
+        WHEN old.code IS NOT new.code
+        BEGIN
+            UPDATE syllabus_chunks SET code = new.code WHERE syllabus_id = old.id;
+        END
+    """)
+    # トリガー作成前に削除されたシラバスのチャンクを片付ける
+    cursor.execute(
+        "DELETE FROM syllabus_chunks WHERE syllabus_id NOT IN (SELECT id FROM syllabuses)"
+    )
+
+    # context_blocksテーブルを作成（科目コードごとのプロンプト用文脈ブロック）
+    # lectures / syllabuses から再構築する派生テーブル（rag_context.py を参照）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS context_blocks (
+            code TEXT PRIMARY KEY,
+            syllabus_id INTEGER NOT NULL,
+            header TEXT NOT NULL,
+            md TEXT NOT NULL,
+            tokens INTEGER NOT NULL,
+            source_version TEXT NOT NULL
+        )
+    """)
+
+    # lecture_timetablesテーブルを作成（中間テーブル方式）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lecture_timetables (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            day_of_week INTEGER NOT NULL,
+            period INTEGER NOT NULL,
+            lecture_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            FOREIGN KEY (lecture_id) REFERENCES lectures(id),
+            UNIQUE(user_id, day_of_week, period)
+        )
+    """)
+
+    # 検索用のインデックスを作成
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_uid ON users(uid)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_title ON lectures(title)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_category ON lectures(category)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_code ON lectures(code)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_name ON lectures(name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lecturer ON lectures(lecturer)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_season ON lectures(season)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_grade ON lectures(grade)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_chunks_syllabus ON syllabus_chunks(syllabus_id, chunk_index)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_timetable_user ON lecture_timetables(user_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_timetable_day_period ON lecture_timetables(day_of_week, period)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_timetable_lecture ON lecture_timetables(lecture_id)"
+    )
+
+    # シラバス全文検索用のFTS5索引（trigramで日本語の部分一致に対応）
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'syllabuses_fts'"
+    )
+    fts_exists = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS syllabuses_fts USING fts5(
+            code,
+            md,
+            content='syllabuses',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_syllabuses_fts_insert
+        AFTER INSERT ON syllabuses
+        BEGIN
+            INSERT INTO syllabuses_fts (rowid, code, md) VALUES (new.id, new.code, new.md);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_syllabuses_fts_delete
+        AFTER DELETE ON syllabuses
+        BEGIN
+            INSERT INTO syllabuses_fts (syllabuses_fts, rowid, code, md)
+            VALUES ('delete', old.id, old.code, old.md);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_syllabuses_fts_update
+        AFTER UPDATE OF code, md ON syllabuses
+        BEGIN
+            INSERT INTO syllabuses_fts (syllabuses_fts, rowid, code, md)
+            VALUES ('delete', old.id, old.code, old.md);
+            INSERT INTO syllabuses_fts (rowid, code, md) VALUES (new.id, new.code, new.md);
+        END
+    """)
+    if not fts_exists:
+        # 既存データを索引に取り込む
+        cursor.execute("INSERT INTO syllabuses_fts (syllabuses_fts) VALUES ('rebuild')")
+
+    # 講義検索用のFTS5索引（trigramで部分一致の候補を絞り込む）
+    columns = ", ".join(LECTURE_TEXT_COLUMNS)
+    new_values = ", ".join(f"new.{c}" for c in LECTURE_TEXT_COLUMNS)
+    old_values = ", ".join(f"old.{c}" for c in LECTURE_TEXT_COLUMNS)
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lectures_fts'"
+    )
+    lectures_fts_exists = cursor.fetchone() is not None
+    cursor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS lectures_fts USING fts5(
+            {columns},
+            content='lectures',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_lectures_fts_insert
+        AFTER INSERT ON lectures
+        BEGIN
+            INSERT INTO lectures_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_lectures_fts_delete
+        AFTER DELETE ON lectures
+        BEGIN
+            INSERT INTO lectures_fts (lectures_fts, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_lectures_fts_update
+        AFTER UPDATE OF {columns} ON lectures
+        BEGIN
+            INSERT INTO lectures_fts (lectures_fts, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+            INSERT INTO lectures_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    """)
+    if not lectures_fts_exists:
+        cursor.execute("INSERT INTO lectures_fts (lectures_fts) VALUES ('rebuild')")
+
+    # lecture_slotsテーブルを作成（lectures.time を曜日・校時ごとに分解したもの）
+    # 「月４、月５」のような複数コマの講義はコマごとに1行になる
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lecture_slots'"
+    )
+    slots_exist = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lecture_slots (
+            day TEXT NOT NULL,
+            period INTEGER NOT NULL,
+            lecture_id INTEGER NOT NULL,
+            PRIMARY KEY (day, period, lecture_id),
+            FOREIGN KEY (lecture_id) REFERENCES lectures(id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_lecture_slots_lecture ON lecture_slots(lecture_id)"
+    )
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lecture_slots_delete
+        AFTER DELETE ON lectures
+        BEGIN
+            DELETE FROM lecture_slots WHERE lecture_id = old.id;
+        END
+    """)
+    # time の解析は Python 側（parse_lecture_slots）で行うため、トリガーでは古いコマを消すのみ。
+    # 新しいコマは update_lecture が入れ直す（SQLで直接更新した場合は rebuild_lecture_slots）
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_lecture_slots_time_update
+        AFTER UPDATE OF time ON lectures
+        WHEN old.time IS NOT new.time
+        BEGIN
+            DELETE FROM lecture_slots WHERE lecture_id = old.id;
+        END
+    """)
+    if not slots_exist:
+        # 既存の講義のコマを取り込む
+        _rebuild_lecture_slots(cursor)
+
+    # テーブル更新検知用のバージョン表（インメモリ索引の再読み込み判定に使用）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for table in VERSIONED_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO table_versions (name, version) VALUES ('{table}', 1)
+                    ON CONFLICT(name) DO UPDATE SET version = version + 1;
+                END
+            """)
+
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def get_table_version(name: str) -> int:
+    """テーブルの更新バージョンを取得（トリガー未作成の場合は0）"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT version FROM table_versions WHERE name = ?", (name,))
+        except sqlite3.OperationalError:
+            return 0
+        row = cursor.fetchone()
+        return row[0] if row else 0
 
-        conn.commit()
-        print("データベースとテーブルが初期化されました")
+
+def get_catalog_version() -> str:
+    """講義・シラバス関連テーブルのバージョンをまとめた文字列（どれかが更新されると変わる）"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT name, version FROM table_versions")
+        except sqlite3.OperationalError:
+            return ""
+        versions = {row["name"]: row["version"] for row in cursor.fetchall()}
+    return ",".join(f"{name}:{versions.get(name, 0)}" for name in VERSIONED_TABLES)
 
 
 def migrate_syllabuses_table():
@@ -141,8 +556,31 @@ def insert_lecture(lecture_data: Dict[str, str]) -> int:
                 lecture_data.get("time"),
             ),
         )
+        lecture_id = cursor.lastrowid
+        _insert_lecture_slots(cursor, lecture_id, lecture_data.get("time"))
         conn.commit()
-        return cursor.lastrowid
+        return lecture_id
+
+
+def update_lecture(lecture_id: int, lecture_data: Dict[str, str]) -> bool:
+    """講義データを更新（lecture_data に含まれる列のみ）
+
+    time を変えた場合は、トリガーで消えた lecture_slots を新しい time から作り直す。
+    """
+    columns = [column for column in LECTURE_TEXT_COLUMNS if column in lecture_data]
+    if not columns:
+        return False
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE lectures SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+            [lecture_data[column] for column in columns] + [lecture_id],
+        )
+        updated = cursor.rowcount > 0
+        if updated and "time" in lecture_data:
+            _insert_lecture_slots(cursor, lecture_id, lecture_data["time"])
+        conn.commit()
+        return updated
 
 
 def insert_syllabus(code: str, html: str, md: str, vector: bytes) -> int:
@@ -160,6 +598,37 @@ def insert_syllabus(code: str, html: str, md: str, vector: bytes) -> int:
         return cursor.lastrowid
 
 
+def replace_syllabus_chunks(syllabus_id: int, code: str, chunks: List[Dict]) -> int:
+    """シラバスのチャンクを置き換える
+
+    chunks: [{"heading": str, "text": str, "vector": bytes}, ...]
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM syllabus_chunks WHERE syllabus_id = ?", (syllabus_id,)
+        )
+        cursor.executemany(
+            """
+            INSERT INTO syllabus_chunks (syllabus_id, code, chunk_index, heading, text, vector)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    syllabus_id,
+                    code,
+                    i,
+                    chunk.get("heading"),
+                    chunk["text"],
+                    chunk.get("vector"),
+                )
+                for i, chunk in enumerate(chunks)
+            ],
+        )
+        conn.commit()
+        return len(chunks)
+
+
 def get_syllabus(syllabus_id: int) -> Optional[Dict]:
     """シラバスデータを取得"""
     with get_db_connection() as conn:
@@ -178,6 +647,213 @@ def get_all_syllabuses() -> List[Dict]:
         return [dict(row) for row in rows]
 
 
+def build_fts_query(text: str) -> Optional[str]:
+    """自然文からFTS5(trigram)のMATCH式を作る
+
+    ひらがな・記号で区切ったカタカナ/漢字/英数字の語のうち3文字以上のものを
+    OR で結合する（trigramは3文字未満の語に一致しないため除外）。
+    """
+    text = unicodedata.normalize("NFKC", text)
+    terms = []
+    for term in re.findall(r"[ァ-ヴー]+|[一-龥々〆ヵヶ]+|[A-Za-z0-9_.-]+", text):
+        if len(term) >= 3 and term not in terms:
+            terms.append(term)
+    if not terms:
+        return None
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_syllabuses_fulltext(
+    query: str, limit: int = 10, codes: Optional[set] = None
+) -> List[Dict]:
+    """シラバス(code, md)をBM25順に全文検索
+
+    codes: 指定時はこの科目コードのシラバスのみを対象にする
+    """
+    match = build_fts_query(query)
+    if match is None or (codes is not None and not codes):
+        return []
+    sql = """
+        SELECT rowid AS id, code, bm25(syllabuses_fts) AS score
+        FROM syllabuses_fts
+        WHERE syllabuses_fts MATCH ?
+    """
+    params = [match]
+    if codes is not None:
+        sql += " AND code IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(sorted(codes), ensure_ascii=False))
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+
+_SLOT_PATTERN = re.compile(r"([月火水木金土日])\s*(\d+)")
+
+
+def parse_lecture_slots(time: Optional[str]) -> List[tuple]:
+    """lectures.time（例: 「月４、月５」「時間割外、火１」）を (曜日, 校時) のリストにする
+
+    数字は全角・半角どちらでもよい。「集中講義」「時間割外」など曜日・校時の無いものは除く。
+    """
+    if not time:
+        return []
+    text = unicodedata.normalize("NFKC", time)
+    slots = [(day, int(period)) for day, period in _SLOT_PATTERN.findall(text)]
+    return list(dict.fromkeys(slots))
+
+
+def _insert_lecture_slots(cursor, lecture_id: int, time: Optional[str]):
+    cursor.executemany(
+        "INSERT OR IGNORE INTO lecture_slots (day, period, lecture_id) VALUES (?, ?, ?)",
+        [(day, period, lecture_id) for day, period in parse_lecture_slots(time)],
+    )
+
+
+def _rebuild_lecture_slots(cursor):
+    cursor.execute("DELETE FROM lecture_slots")
+    cursor.execute("SELECT id, time FROM lectures")
+    for row in cursor.fetchall():
+        _insert_lecture_slots(cursor, row["id"], row["time"])
+
+
+def rebuild_lecture_slots():
+    """lecture_slots を lectures.time から作り直す（update_lecture を通さず time を更新した後に使う）"""
+    with get_db_connection() as conn:
+        _rebuild_lecture_slots(conn.cursor())
+        conn.commit()
+
+
+def get_lectures_by_slot(day: str, period: int) -> List[Dict]:
+    """指定した曜日・校時に開講される講義（lecture_slots の索引で検索）"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT l.* FROM lecture_slots s
+            JOIN lectures l ON l.id = s.lecture_id
+            WHERE s.day = ? AND s.period = ?
+            ORDER BY l.id
+            """,
+            (day, int(period)),
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+
+# ベクトル検索の絞り込みに使える lectures の列（完全一致、索引を利用）
+LECTURE_FILTER_COLUMNS = ("season", "grade", "category", "class_name")
+
+
+def find_lecture_codes(filters: Dict) -> Optional[set]:
+    """絞り込み条件に合う講義の科目コード集合を返す（条件が無ければNone）
+
+    filters: {"season": "後期", "day": "月", "period": 2, "grade": ..., "category": ...}
+        season/grade/category/class_name は完全一致（リスト指定でいずれか）、
+        day/period は曜日・校時で絞り込む
+    """
+    conditions = []
+    params = []
+    for column in LECTURE_FILTER_COLUMNS:
+        value = filters.get(column)
+        if value in (None, "", []):
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        conditions.append(f"{column} IN ({','.join('?' * len(values))})")
+        params.extend(values)
+
+    day = filters.get("day")
+    period = filters.get("period")
+    if day or period:
+        slot_conditions = []
+        if day:
+            slot_conditions.append("day = ?")
+            params.append(day)
+        if period:
+            slot_conditions.append("period = ?")
+            params.append(int(period))
+        conditions.append(
+            "id IN (SELECT lecture_id FROM lecture_slots WHERE "
+            + " AND ".join(slot_conditions)
+            + ")"
+        )
+
+    if not conditions:
+        return None
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT DISTINCT code FROM lectures WHERE {' AND '.join(conditions)}",
+            params,
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _fts_phrase(text: str) -> Optional[str]:
+    """部分一致を trigram の MATCH 句に変換（索引で絞り込めない語は None）
+
+    trigram は3文字未満の語を検索できず、LIKE のワイルドカード（% _）も
+    MATCH では文字として扱われるため、これらは LIKE のみで判定する。
+    """
+    if len(text) < 3 or "%" in text or "_" in text:
+        return None
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _lecture_search_query(
+    filters: Dict[str, Optional[str]],
+    keyword: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+):
+    """search_lectures の SQL とパラメータを組み立てる"""
+    # クエリを構築
+    query = f"SELECT {', '.join(fields) if fields else '*'} FROM lectures WHERE 1=1"
+    params = []
+    match_terms = []
+
+    # フィルタリング条件
+    for column in LECTURE_TEXT_COLUMNS:
+        value = filters.get(column)
+        if not value:
+            continue
+        query += f" AND {column} LIKE ?"
+        params.append(f"%{value}%")
+        phrase = _fts_phrase(value)
+        if phrase:
+            match_terms.append(f"{column} : {phrase}")
+
+    # キーワード検索（全フィールドを対象）
+    if keyword:
+        query += (
+            " AND ("
+            + " OR ".join(f"{column} LIKE ?" for column in LECTURE_TEXT_COLUMNS)
+            + ")"
+        )
+        params.extend([f"%{keyword}%"] * len(LECTURE_TEXT_COLUMNS))
+        phrase = _fts_phrase(keyword)
+        if phrase:
+            match_terms.append(phrase)
+
+    if match_terms:
+        query += (
+            " AND id IN (SELECT rowid FROM lectures_fts WHERE lectures_fts MATCH ?)"
+        )
+        params.append(" AND ".join(match_terms))
+
+    if after_id is not None:
+        query += " AND id > ?"
+        params.append(after_id)
+    # 列を絞ると被覆インデックス（idx_name など）の順で返りうるため、常に id 順に固定する
+    query += " ORDER BY id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    return query, params
+
+
 def search_lectures(
     title: Optional[str] = None,
     category: Optional[str] = None,
@@ -189,68 +865,36 @@ def search_lectures(
     season: Optional[str] = None,
     time: Optional[str] = None,
     keyword: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
 ) -> List[Dict]:
-    """講義を検索"""
+    """講義を検索（各条件・キーワードとも部分一致）
+
+    lectures_fts（trigram）で候補を絞り込んでから、従来どおり LIKE で判定する。
+    絞り込みは LIKE で一致する行を必ず含むため、結果は LIKE のみの場合と同じ。
+    fields: 取得する列（None で全列。呼び出し側で列名を検証済みであること）
+    after_id / limit: 結果は常に id 順。after_id より後の limit 件を返す（キーセット方式）
+    """
+    query, params = _lecture_search_query(
+        {
+            "title": title,
+            "category": category,
+            "code": code,
+            "name": name,
+            "lecturer": lecturer,
+            "grade": grade,
+            "class_name": class_name,
+            "season": season,
+            "time": time,
+        },
+        keyword=keyword,
+        fields=fields,
+        after_id=after_id,
+        limit=limit,
+    )
     with get_db_connection() as conn:
         cursor = conn.cursor()
-
-        # クエリを構築
-        query = "SELECT * FROM lectures WHERE 1=1"
-        params = []
-
-        # フィルタリング条件
-        if title:
-            query += " AND title LIKE ?"
-            params.append(f"%{title}%")
-
-        if category:
-            query += " AND category LIKE ?"
-            params.append(f"%{category}%")
-
-        if code:
-            query += " AND code LIKE ?"
-            params.append(f"%{code}%")
-
-        if name:
-            query += " AND name LIKE ?"
-            params.append(f"%{name}%")
-
-        if lecturer:
-            query += " AND lecturer LIKE ?"
-            params.append(f"%{lecturer}%")
-
-        if grade:
-            query += " AND grade LIKE ?"
-            params.append(f"%{grade}%")
-
-        if class_name:
-            query += " AND class_name LIKE ?"
-            params.append(f"%{class_name}%")
-
-        if season:
-            query += " AND season LIKE ?"
-            params.append(f"%{season}%")
-
-        if time:
-            query += " AND time LIKE ?"
-            params.append(f"%{time}%")
-
-        # キーワード検索（全フィールドを対象）
-        if keyword:
-            query += """ AND (
-                title LIKE ? OR 
-                category LIKE ? OR 
-                code LIKE ? OR 
-                name LIKE ? OR 
-                lecturer LIKE ? OR 
-                grade LIKE ? OR 
-                class_name LIKE ? OR 
-                season LIKE ? OR 
-                time LIKE ?
-            )"""
-            keyword_param = f"%{keyword}%"
-            params.extend([keyword_param] * 9)
-
         cursor.execute(query, params)
         rows = cursor.fetchall()
 
@@ -258,6 +902,14 @@ def search_lectures(
         return [dict(row) for row in rows]
 
 
+def iter_lectures(
+    keyword: Optional[str] = None, fields: Optional[List[str]] = None, **filters
+) -> Iterator[Dict]:
+    """search_lectures と同じ条件の講義を id 順に1行ずつ返す（全件を保持しない）"""
+    query, params = _lecture_search_query(filters, keyword=keyword, fields=fields)
+    return iter_query(query, params)
+
+
 def create_empty_timetable() -> dict:
     """空の時間割テンプレートを作成"""
     timetable = {}
@@ -370,6 +1022,11 @@ def get_all_users() -> List[Dict]:
         return [dict(row) for row in rows]
 
 
+def iter_all_users() -> Iterator[Dict]:
+    """get_all_users と同じ並びでユーザーを1行ずつ返す（全件を保持しない）"""
+    return iter_query("SELECT id, name FROM users ORDER BY created_at DESC")
+
+
 # 時間割関連の関数（中間テーブル方式）
 def insert_timetable_entry(
     user_id: int, day_of_week: int, period: int, lecture_id: Optional[int] = None
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from database import get_db_connection
+
+# キャッシュ設定
+# プロセス内LRUに保持する件数
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(
+    os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "1024")
+)
+# SQLiteに保持する最大件数（超えた分は最終利用が古い順に削除）
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+# 有効期限（秒）。モデル更新時などに古い埋め込みが残り続けないようにする
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+def normalize_query(text: str) -> str:
+    """キャッシュキー用にクエリを正規化（全角半角統一・空白圧縮・小文字化）"""
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).lower()
+
+
+# ========================
+#  クエリ埋め込みキャッシュ
+# ========================
+class EmbeddingCache:
+    """正規化済みクエリ文字列 → float32埋め込み のキャッシュ
+
+    プロセス内LRU（OrderedDict）の後ろに SQLite の query_embeddings テーブルを置き、
+    ワーカー間・CGIプロセス間でも同じ質問ではAPI呼び出しを省略する。
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl: float = EMBEDDING_CACHE_TTL,
+    ):
+        self.namespace = namespace
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._table_ready = False
+        # 未反映の最終利用時刻（キー → 時刻）。ヒット時は書き込まず次の put でまとめて反映する
+        self._touched: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.evictions = 0
+
+    def _key(self, text: str) -> str:
+        raw = f"{self.namespace}\n{normalize_query(text)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _ensure_table(self, conn):
+        if self._table_ready:
+            return
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_query_embeddings_last_used ON query_embeddings(last_used_at)"
+        )
+        conn.commit()
+        self._table_ready = True
+
+    def _remember(self, key: str, vector: List[float], created_at: float):
+        with self._lock:
+            self._memory[key] = (vector, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """キャッシュ済みの埋め込みを返す（無い・期限切れならNone）"""
+        key = self._key(text)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._memory[key]
+
+        with get_db_connection() as conn:
+            self._ensure_table(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT vector, created_at FROM query_embeddings WHERE key = ?",
+                (key,),
+            )
+            row = cursor.fetchone()
+        # 期限切れの行は put で削除されるので、ここでは読むだけにする
+        # （他の書き込み中でもヒットがロック待ちで失敗しないようにする）
+        if row is None or now - row["created_at"] > self.ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        vector = np.frombuffer(row["vector"], dtype=np.float32).tolist()
+        self._remember(key, vector, row["created_at"])
+        with self._lock:
+            self._touched[key] = now
+            self.hits += 1
+            self.db_hits += 1
+        return vector
+
+    def put(self, text: str, vector: List[float]):
+        """埋め込みを保存し、件数上限を超えた分を古い順に削除"""
+        key = self._key(text)
+        now = time.time()
+        self._remember(key, vector, now)
+
+        with get_db_connection() as conn:
+            self._ensure_table(conn)
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO query_embeddings (key, vector, created_at, last_used_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (key, np.asarray(vector, dtype=np.float32).tobytes(), now, now),
+            )
+            # ヒット時の最終利用時刻を、件数上限による削除の前に反映する
+            with self._lock:
+                touched, self._touched = self._touched, {}
+            cursor.executemany(
+                "UPDATE query_embeddings SET last_used_at = ? WHERE key = ?",
+                [(used_at, k) for k, used_at in touched.items()],
+            )
+            evicted = 0
+            cursor.execute("SELECT COUNT(*) FROM query_embeddings")
+            overflow = cursor.fetchone()[0] - self.max_entries
+            if overflow > 0:
+                cursor.execute(
+                    """
+                    DELETE FROM query_embeddings WHERE key IN (
+                        SELECT key FROM query_embeddings ORDER BY last_used_at LIMIT ?
+                    )
+                    """,
+                    (overflow,),
+                )
+                evicted += cursor.rowcount
+            cursor.execute(
+                "DELETE FROM query_embeddings WHERE created_at < ?", (now - self.ttl,)
+            )
+            evicted += cursor.rowcount
+            conn.commit()
+        with self._lock:
+            self.evictions += evicted
+
+    def stats(self) -> Dict[str, float]:
+        """ヒット率などの統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "pending_touches": len(self._touched),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import httpx
+from typing import Any, Dict, Optional
+
+# 外部API（Gemini / Cohere）呼び出し用コネクションプールの設定
+HTTP_CLIENT_HTTP2 = os.getenv("HTTP_CLIENT_HTTP2", "true") == "true"
+# 同時に開くコネクション数の上限
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+# 待機状態で保持するkeep-aliveコネクション数
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+# 使われていないkeep-aliveコネクションを閉じるまでの秒数
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+
+# ========================
+#  接続再利用の統計付きトランスポート
+# ========================
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """リクエスト数と新規TCP接続数を数え、接続の再利用率を求められるようにする"""
+
+    def __init__(self, stats: Dict[str, int], **kwargs):
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._stats["requests"] += 1
+        request.extensions = {**request.extensions, "trace": self._trace}
+        return await super().handle_async_request(request)
+
+    async def _trace(self, event: str, info: Dict[str, Any]):
+        # httpcore のトレースイベント（接続確立・送信プロトコル）を集計
+        if event == "connection.connect_tcp.complete":
+            self._stats["new_connections"] += 1
+        elif event == "http2.send_request_headers.started":
+            self._stats["http2_requests"] += 1
+
+
+_stats = {
+    "clients_created": 0,
+    "requests": 0,
+    "new_connections": 0,
+    "http2_requests": 0,
+}
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _create_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    _stats["clients_created"] += 1
+    return httpx.AsyncClient(
+        transport=_CountingTransport(_stats, http2=HTTP_CLIENT_HTTP2, limits=limits),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+
+# ========================
+#  共有クライアント
+# ========================
+def get_http_client() -> httpx.AsyncClient:
+    """プロセス内で共有する AsyncClient を取得
+
+    コネクションはイベントループに紐づくため、ループが変わった場合
+    （CGIで asyncio.run を呼ぶたび等）は作り直す。
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = _create_client()
+        _client_loop = loop
+    return _client
+
+
+async def start_http_client():
+    """アプリ起動時にクライアントを作成"""
+    get_http_client()
+
+
+async def close_http_client():
+    """アプリ終了時にコネクションを閉じる"""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def get_http_client_stats() -> Dict[str, float]:
+    """接続再利用の統計（reused = リクエスト数 - 新規接続数）"""
+    requests = _stats["requests"]
+    reused = max(requests - _stats["new_connections"], 0)
+    pool = getattr(_client._transport, "_pool", None) if _client else None
+    return {
+        **_stats,
+        "reused_connections": reused,
+        "reuse_rate": reused / requests if requests else 0.0,
+        "open_connections": len(pool.connections) if pool is not None else 0,
+        "http2": HTTP_CLIENT_HTTP2,
+    }
@@ -3,15 +3,21 @@ import base64
 import json
 from fastapi import FastAPI, Query, HTTPException, Header, Response, Request, Cookie
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Optional, List
+from typing import Any, Dict, Optional, List, Union
 from service import (
     generate_page_with_ai,
     get_lectures_service,
     get_syllabus_html_service,
     chat_service,
+    sse_events,
     init_database_service,
+    get_metrics_service,
+    search_similar_batch,
+    stream_lectures_service,
+    stream_users_service,
+    NDJSON_MEDIA_TYPE,
 )
 from database import (
     get_or_create_user,
@@ -21,6 +27,9 @@ from database import (
     get_all_users,
     get_user_by_id,
 )
+from http_client import start_http_client, close_http_client
+from async_db import run_db, shutdown_db_executor
+from page_jobs import PageJobWorkers, get_job, job_events, submit_job
 import os
 import secrets
 import jwt
@@ -31,6 +40,25 @@ app = FastAPI()
 # データベースを初期化
 init_database_service()
 
+
+# ページ生成ジョブを処理するワーカープール
+page_job_workers = PageJobWorkers()
+
+
+# 外部API呼び出し用のコネクションプールとワーカーをアプリと同じ寿命で保持
+@app.on_event("startup")
+async def startup():
+    await start_http_client()
+    await page_job_workers.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await page_job_workers.stop()
+    await close_http_client()
+    shutdown_db_executor()
+
+
 # CORS 設定
 app.add_middleware(
     CORSMiddleware,
@@ -59,9 +87,25 @@ class LectureResponse(BaseModel):
     time: Optional[str] = None
 
 
+class LecturePage(BaseModel):
+    items: List[LectureResponse]
+    next_cursor: Optional[str] = None
+    has_more: bool
+
+
 class RAGRequest(BaseModel):
     question: str
     messages: Optional[List[Dict[str, str]]] = []
+    mode: Optional[str] = None  # "vector" / "keyword" / "hybrid"
+    # 講義の絞り込み条件: season, day, period, grade, category, class_name
+    filters: Optional[Dict[str, Any]] = None
+
+
+class SimilarSearchRequest(BaseModel):
+    texts: Optional[List[str]] = None  # クエリ文（まとめて埋め込み）
+    codes: Optional[List[str]] = None  # 科目コード（そのシラバスに似た科目）
+    top_k: int = 10
+    filters: Optional[Dict[str, Any]] = None
 
 
 class RAGResponse(BaseModel):
@@ -96,6 +140,11 @@ class TimetableRemoveRequest(BaseModel):
     period: int  # 1=1限, 2=2限, ..., 6=6限
 
 
+def wants_ndjson(request: Request) -> bool:
+    """NDJSONでのストリーミング応答を求められているか（Acceptヘッダで判定）"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
 def verify_auth(cookie: str = Header(None)) -> Optional[Dict]:
     """Cookieから直接セッション情報を解析して認証を確認"""
     if not cookie:
@@ -261,7 +310,10 @@ def root():
 
 @app.post("/api/generate-page")
 async def generate_page(
-    request: Request, response: Response, session_data: Optional[str] = Cookie(None)
+    request: Request,
+    page_request: PageRequest,
+    response: Response,
+    session_data: Optional[str] = Cookie(None),
 ) -> HTMLResponse:
     session = get_session_data_from_cookie(session_data)
     if not session.get("logged_in"):
@@ -269,11 +321,50 @@ async def generate_page(
     request.scope["user_id"] = session[
         "user_id"
     ]  # FastAPIのRequestオブジェクトにユーザーIDを設定
-    return await generate_page_with_ai(request.prompt)
+    return await generate_page_with_ai(page_request.prompt)
 
 
-@app.get("/api/lectures", response_model=List[LectureResponse])
+@app.post("/api/page-jobs", status_code=202)
+async def create_page_job(
+    page_request: PageRequest, session_data: Optional[str] = Cookie(None)
+):
+    """ページ生成ジョブを登録してジョブIDを返す（同じプロンプトは生成済み結果を再利用）"""
+    session = get_session_data_from_cookie(session_data)
+    if not session.get("logged_in"):
+        raise HTTPException(status_code=401, detail="認証が必要です")
+    job, cached = await run_db(submit_job, page_request.prompt)
+    if not cached:
+        page_job_workers.wake()
+    return {**job, "cached": cached}
+
+
+@app.get("/api/page-jobs/{job_id}")
+def get_page_job(job_id: str):
+    """ページ生成ジョブの状態・結果を取得"""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    return job
+
+
+@app.get("/api/page-jobs/{job_id}/events")
+def stream_page_job(job_id: str):
+    """ページ生成ジョブの状態を Server-Sent Events で通知（完了・失敗で終了）"""
+    return StreamingResponse(
+        job_events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get(
+    "/api/lectures",
+    response_model=Union[List[LectureResponse], LecturePage],
+    # fields で絞った項目を null で埋め戻さない
+    response_model_exclude_unset=True,
+)
 def get_lectures(
+    request: Request,
     title: Optional[str] = Query(None, description="タイトルでフィルタリング"),
     category: Optional[str] = Query(None, description="カテゴリでフィルタリング"),
     code: Optional[str] = Query(None, description="科目コードでフィルタリング"),
@@ -284,7 +375,32 @@ def get_lectures(
     season: Optional[str] = Query(None, description="開講学期でフィルタリング"),
     time: Optional[str] = Query(None, description="曜日・校時でフィルタリング"),
     keyword: Optional[str] = Query(None, description="全フィールドでキーワード検索"),
+    limit: Optional[int] = Query(
+        None, description="1ページの件数（指定するとページ単位で返す）"
+    ),
+    cursor: Optional[str] = Query(None, description="前ページの next_cursor"),
+    fields: Optional[str] = Query(
+        None, description="返す項目をカンマ区切りで指定（例: name,time）"
+    ),
 ):
+    """講義を検索（Accept: application/x-ndjson の場合は該当する全件を1行ずつ返す）"""
+    if wants_ndjson(request):
+        return StreamingResponse(
+            stream_lectures_service(
+                title=title,
+                category=category,
+                code=code,
+                name=name,
+                lecturer=lecturer,
+                grade=grade,
+                class_name=class_name,
+                season=season,
+                time=time,
+                keyword=keyword,
+                fields=fields,
+            ),
+            media_type=NDJSON_MEDIA_TYPE,
+        )
     return get_lectures_service(
         title=title,
         category=category,
@@ -296,6 +412,9 @@ def get_lectures(
         season=season,
         time=time,
         keyword=keyword,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
     )
 
 
@@ -306,7 +425,31 @@ def get_syllabus_html(code: str):
 
 @app.post("/api/chat")
 async def chat(request: RAGRequest):
-    return await chat_service(request)
+    """回答を Server-Sent Events で逐次返す（検索エラーは通常のHTTPエラー）"""
+    chunks = await chat_service(request.dict())
+    return StreamingResponse(
+        sse_events(chunks),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/search/similar")
+async def search_similar(request: SimilarSearchRequest):
+    """複数のクエリ文・科目コードについて類似科目を一括検索"""
+    results = await search_similar_batch(
+        texts=request.texts,
+        codes=request.codes,
+        top_k=request.top_k,
+        filters=request.filters,
+    )
+    return {"results": results}
+
+
+@app.get("/api/metrics")
+def get_metrics():
+    """キャッシュなどの内部統計を取得"""
+    return {**get_metrics_service(), "page_jobs": page_job_workers.stats()}
 
 
 @app.post("/api/auth/login", response_model=UserResponse)
@@ -347,8 +490,12 @@ async def add_lecture_to_timetable(
         raise HTTPException(status_code=403, detail="自分の時間割のみ更新できます")
 
     try:
-        insert_timetable_entry(
-            user_id, request.day_of_week, request.period, request.lecture_id
+        await run_db(
+            insert_timetable_entry,
+            user_id,
+            request.day_of_week,
+            request.period,
+            request.lecture_id,
         )
         return {"message": "講義を追加しました", "success": True}
     except Exception as e:
@@ -368,7 +515,9 @@ async def remove_lecture_from_timetable(
         raise HTTPException(status_code=403, detail="自分の時間割のみ更新できます")
 
     try:
-        success = delete_timetable_entry(user_id, request.day_of_week, request.period)
+        success = await run_db(
+            delete_timetable_entry, user_id, request.day_of_week, request.period
+        )
         if success:
             return {"message": "講義を削除しました", "success": True}
         else:
@@ -378,8 +527,10 @@ async def remove_lecture_from_timetable(
 
 
 @app.get("/api/users", response_model=List[UserResponse])
-def get_users():
-    """全ユーザーの一覧を取得"""
+def get_users(request: Request):
+    """全ユーザーの一覧を取得（Accept: application/x-ndjson の場合は1行ずつ返す）"""
+    if wants_ndjson(request):
+        return StreamingResponse(stream_users_service(), media_type=NDJSON_MEDIA_TYPE)
     return get_all_users()
 
 
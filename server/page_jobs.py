@@ -0,0 +1,333 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from async_db import run_db
+from database import get_db_connection
+from service import format_sse, generate_page_with_ai
+
+# ページ生成ジョブの設定
+# 同時に実行するジョブ数（FastAPIのワーカータスク数・CGI実行プロセス数の上限）
+PAGE_JOB_WORKERS = int(os.getenv("PAGE_JOB_WORKERS", "2"))
+# 待機できるジョブ数（超えたら 503 を返す）
+PAGE_JOB_MAX_QUEUED = int(os.getenv("PAGE_JOB_MAX_QUEUED", "50"))
+# 同じプロンプトの生成結果を再利用する期間（秒）
+PAGE_JOB_CACHE_TTL = float(os.getenv("PAGE_JOB_CACHE_TTL", str(7 * 24 * 3600)))
+# この秒数以上 running のままのジョブは実行プロセスが落ちたとみなして再実行する
+PAGE_JOB_STALE_AFTER = float(os.getenv("PAGE_JOB_STALE_AFTER", "300"))
+# 状態のストリーミングで確認する間隔（秒）
+PAGE_JOB_POLL_INTERVAL = 0.5
+# ワーカーで予期しないエラーが起きた後、次の取り出しまで待つ秒数
+PAGE_JOB_ERROR_BACKOFF = 5.0
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "done", "error")
+
+_table_ready = False
+
+
+def _ensure_table(conn):
+    global _table_ready
+    if _table_ready:
+        return
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS page_jobs (
+            id TEXT PRIMARY KEY,
+            prompt_hash TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_page_jobs_hash ON page_jobs(prompt_hash, status)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_page_jobs_status ON page_jobs(status, created_at)"
+    )
+    conn.commit()
+    _table_ready = True
+
+
+def prompt_hash(prompt: str) -> str:
+    # HTML・CSSを含むプロンプトでは大文字小文字も意味を持つため、前後の空白のみ無視する
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()
+
+
+def _row_to_job(row) -> Dict[str, Any]:
+    return {
+        "job_id": row["id"],
+        "status": row["status"],
+        "result": json.loads(row["result"]) if row["result"] else None,
+        "error": row["error"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+# ========================
+#  ジョブの登録・取得
+# ========================
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    with get_db_connection() as conn:
+        _ensure_table(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM page_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+    return _row_to_job(row) if row else None
+
+
+def submit_job(prompt: str) -> Tuple[Dict[str, Any], bool]:
+    """ジョブを登録する（戻り値: ジョブ, 既存ジョブを再利用したか）
+
+    同じプロンプトの生成済み結果（PAGE_JOB_CACHE_TTL 以内）や実行中のジョブがあれば
+    新たに生成せずそのジョブを返す。
+    """
+    if not prompt or not prompt.strip():
+        raise HTTPException(status_code=400, detail="prompt を指定してください")
+    key = prompt_hash(prompt)
+    now = time.time()
+    with get_db_connection() as conn:
+        _ensure_table(conn)
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT * FROM page_jobs
+            WHERE prompt_hash = ?
+              AND (status IN ('queued', 'running')
+                   OR (status = 'done' AND updated_at >= ?))
+            ORDER BY status = 'done' DESC, updated_at DESC
+            LIMIT 1
+            """,
+            (key, now - PAGE_JOB_CACHE_TTL),
+        )
+        row = cursor.fetchone()
+        if row is not None:
+            return _row_to_job(row), True
+
+        cursor.execute("SELECT COUNT(*) FROM page_jobs WHERE status = 'queued'")
+        if cursor.fetchone()[0] >= PAGE_JOB_MAX_QUEUED:
+            raise HTTPException(
+                status_code=503,
+                detail="ページ生成が混雑しています。しばらく時間をおいてから再試行してください。",
+                headers={"Retry-After": "30"},
+            )
+        job_id = uuid.uuid4().hex
+        cursor.execute(
+            """
+            INSERT INTO page_jobs (id, prompt_hash, prompt, status, created_at, updated_at)
+            VALUES (?, ?, ?, 'queued', ?, ?)
+            """,
+            (job_id, key, prompt, now, now),
+        )
+        conn.commit()
+        cursor.execute("SELECT * FROM page_jobs WHERE id = ?", (job_id,))
+        return _row_to_job(cursor.fetchone()), False
+
+
+def claim_next_job(max_running: int = PAGE_JOB_WORKERS) -> Optional[Dict[str, Any]]:
+    """最も古い queued ジョブを running にして取り出す（実行中が上限なら None）"""
+    now = time.time()
+    with get_db_connection() as conn:
+        _ensure_table(conn)
+        cursor = conn.cursor()
+        # 複数プロセスが同じジョブを取らないよう書き込みロックを取ってから確認する
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "UPDATE page_jobs SET status = 'queued', updated_at = ? WHERE status = 'running' AND updated_at < ?",
+            (now, now - PAGE_JOB_STALE_AFTER),
+        )
+        cursor.execute("SELECT COUNT(*) FROM page_jobs WHERE status = 'running'")
+        if cursor.fetchone()[0] >= max_running:
+            conn.commit()
+            return None
+        cursor.execute(
+            "SELECT * FROM page_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+        )
+        row = cursor.fetchone()
+        if row is None:
+            conn.commit()
+            return None
+        cursor.execute(
+            "UPDATE page_jobs SET status = 'running', updated_at = ? WHERE id = ?",
+            (now, row["id"]),
+        )
+        conn.commit()
+    return {"job_id": row["id"], "prompt": row["prompt"]}
+
+
+def _finish_job(
+    job_id: str, result: Optional[Dict] = None, error: Optional[str] = None
+):
+    with get_db_connection() as conn:
+        _ensure_table(conn)
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE page_jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+            (
+                "error" if error is not None else "done",
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                error,
+                time.time(),
+                job_id,
+            ),
+        )
+        conn.commit()
+
+
+async def run_job(job: Dict[str, Any]) -> bool:
+    """ジョブを1件実行して結果を保存する（戻り値: 成功したか）"""
+    try:
+        page = await generate_page_with_ai(job["prompt"])
+    except HTTPException as e:
+        await run_db(_finish_job, job["job_id"], error=str(e.detail))
+        return False
+    except Exception as e:
+        await run_db(_finish_job, job["job_id"], error=str(e))
+        return False
+    await run_db(_finish_job, job["job_id"], result=page)
+    return True
+
+
+def count_jobs() -> Dict[str, int]:
+    with get_db_connection() as conn:
+        _ensure_table(conn)
+        cursor = conn.cursor()
+        cursor.execute("SELECT status, COUNT(*) FROM page_jobs GROUP BY status")
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+    return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+
+async def job_events(job_id: str) -> AsyncIterator[str]:
+    """ジョブの状態が変わるたびに SSE の status イベントを送り、完了・失敗で終える"""
+    last_status = None
+    while True:
+        job = await run_db(get_job, job_id)
+        if job is None:
+            yield format_sse({"detail": "ジョブが見つかりません"}, event="error")
+            return
+        if job["status"] != last_status:
+            last_status = job["status"]
+            yield format_sse(job, event="status")
+        if job["status"] in ("done", "error"):
+            return
+        await asyncio.sleep(PAGE_JOB_POLL_INTERVAL)
+
+
+# ========================
+#  ワーカープール（FastAPI）
+# ========================
+class PageJobWorkers:
+    """アプリと同じ寿命で動く固定数のワーカータスク
+
+    ジョブはSQLiteから取り出すため、他プロセスが登録したジョブも処理できる。
+    """
+
+    def __init__(self, workers: int = PAGE_JOB_WORKERS):
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.processed = 0
+        self.failed = 0
+        self.errors = 0
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """待機中のワーカーを起こす（同期エンドポイントなど別スレッドからも呼べる）"""
+        if self._wakeup is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await run_db(claim_next_job, self.workers)
+                if job is not None:
+                    if await run_job(job):
+                        self.processed += 1
+                    else:
+                        self.failed += 1
+                    continue
+            except Exception:
+                # DBのロック待ちの打ち切りなどで止まらないよう、記録して少し待ってから続ける
+                self.errors += 1
+                logger.exception("ページ生成ワーカーでエラーが発生しました")
+                await asyncio.sleep(PAGE_JOB_ERROR_BACKOFF)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": sum(not task.done() for task in self._tasks),
+            "processed": self.processed,
+            "failed": self.failed,
+            "errors": self.errors,
+            **count_jobs(),
+        }
+
+
+# ========================
+#  CGI用の切り離し実行
+# ========================
+def spawn_detached_runner():
+    """リクエストと切り離したプロセスで待機中のジョブを処理する（CGI用）
+
+    CGIでは応答を返すとプロセスが終わるため、別セッションの子プロセスを起動する。
+    同時実行数の上限は claim_next_job が守るので、余分に起動しても何もせず終了する。
+    """
+    if count_jobs()["running"] >= PAGE_JOB_WORKERS:
+        return
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "run"],
+        cwd=os.getcwd(),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+        close_fds=True,
+    )
+
+
+async def run_pending_jobs() -> int:
+    """待機中のジョブが無くなるまで処理する（戻り値: 処理件数）"""
+    processed = 0
+    while True:
+        job = await run_db(claim_next_job)
+        if job is None:
+            return processed
+        await run_job(job)
+        processed += 1
+
+
+if __name__ == "__main__":
+    # python page_jobs.py run : 待機中のページ生成ジョブを処理する
+    if len(sys.argv) > 1 and sys.argv[1] == "run":
+        asyncio.run(run_pending_jobs())
+    else:
+        print("usage: python page_jobs.py run")
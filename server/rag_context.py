@@ -0,0 +1,281 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from database import get_db_connection
+
+# プロンプトに含めるシラバス情報の予算（推定トークン数）
+# プロンプト長がそのままGeminiの応答時間に効くため、上限を設けて詰め込む
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "8000"))
+# 1科目あたりの上限（長いシラバス1件で予算を使い切らないようにする）
+RAG_SECTION_MAX_TOKENS = int(os.getenv("RAG_SECTION_MAX_TOKENS", "2000"))
+# 切り詰め後にこれより短くなる科目は含めない
+RAG_SECTION_MIN_TOKENS = int(os.getenv("RAG_SECTION_MIN_TOKENS", "200"))
+
+SECTION_SEPARATOR = "\n\n---\n\n"
+SECTION_BODY_LABEL = "\n\nシラバス内容:\n"
+TRUNCATION_MARK = "\n…（以下省略）"
+
+# 日本語（かな・漢字・全角記号）は1文字≒1トークン、それ以外は4文字≒1トークンとして見積もる
+_WIDE_CHARS = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """テキストのトークン数の概算"""
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """推定トークン数が max_tokens 以下になるよう末尾を切り詰める（可能なら行単位）"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARK)
+    if budget <= 0:
+        return ""
+    cost = 0.0
+    end = 0
+    for i, ch in enumerate(text):
+        cost += 1.0 if _WIDE_CHARS.match(ch) else 0.25
+        if cost > budget:
+            break
+        end = i + 1
+    # 行の途中で切れる場合は、後半に改行があればそこで切る
+    newline = text.rfind("\n", 0, end)
+    if newline > end // 2:
+        end = newline
+    return text[:end].rstrip() + TRUNCATION_MARK
+
+
+def _lecture_header(lecture_info: Optional[Dict]) -> str:
+    if lecture_info:
+        return f"""
+講義名: {lecture_info["name"] or "情報なし"}
+講師: {lecture_info["lecturer"] or "情報なし"}
+学年: {lecture_info["grade"] or "情報なし"}
+曜日・校時: {lecture_info["time"] or "情報なし"}
+"""
+    return "講義情報: 該当なし"
+
+
+# ========================
+#  科目コードごとの文脈ブロック（事前構築）
+# ========================
+def _source_version(cursor) -> str:
+    # トリガー未作成の場合は get_table_version と同じく0として扱う
+    try:
+        cursor.execute(
+            "SELECT name, version FROM table_versions WHERE name IN ('lectures', 'syllabuses')"
+        )
+    except sqlite3.OperationalError:
+        return "0:0"
+    versions = {row["name"]: row["version"] for row in cursor.fetchall()}
+    return f"{versions.get('lectures', 0)}:{versions.get('syllabuses', 0)}"
+
+
+def _blocks_stale(cursor, version: str) -> bool:
+    cursor.execute("SELECT source_version FROM context_blocks LIMIT 1")
+    row = cursor.fetchone()
+    if row is not None:
+        return row["source_version"] != version
+    # ブロックが無くても、元になるシラバスが無ければ作り直す必要はない
+    cursor.execute("SELECT 1 FROM syllabuses WHERE code IS NOT NULL LIMIT 1")
+    return cursor.fetchone() is not None
+
+
+# このプロセスで最新と確認済みの元データのバージョン
+_fresh_version: Optional[str] = None
+
+
+def rebuild_context_blocks(force: bool = False) -> int:
+    """lectures / syllabuses から context_blocks を作り直す（変更が無ければ何もしない）
+
+    科目コードごとに最初のシラバスと最初の講義から「講義ヘッダ + md」を組み立て、
+    推定トークン数とともに保存する。チャット時はこの表を1回引くだけで文脈を作れる。
+    最新かどうかは読み取りのみで確認し、古い場合に限り書き込みロックを取る。
+    戻り値: 再構築したブロック数（再構築しなかった場合は -1）
+    """
+    global _fresh_version
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if not force:
+            version = _source_version(cursor)
+            if version == _fresh_version:
+                return -1
+            if not _blocks_stale(cursor, version):
+                _fresh_version = version
+                return -1
+
+        # 複数プロセスが同時に再構築しないよう書き込みロックを取ってから確認し直す
+        cursor.execute("BEGIN IMMEDIATE")
+        version = _source_version(cursor)
+        if not force and not _blocks_stale(cursor, version):
+            conn.rollback()
+            _fresh_version = version
+            return -1
+
+        cursor.execute("""
+            SELECT
+                s.id,
+                s.code,
+                s.md,
+                l.id AS lecture_id,
+                l.name,
+                l.lecturer,
+                l.grade,
+                l.time
+            FROM syllabuses s
+            LEFT JOIN lectures l ON l.id = (
+                SELECT id FROM lectures WHERE code = s.code ORDER BY id LIMIT 1
+            )
+            WHERE s.code IS NOT NULL
+              AND s.id = (SELECT MIN(id) FROM syllabuses WHERE code = s.code)
+        """)
+        blocks = []
+        for row in cursor.fetchall():
+            lecture = row if row["lecture_id"] is not None else None
+            header = _lecture_header(lecture)
+            md = row["md"] or ""
+            tokens = estimate_tokens(header + SECTION_BODY_LABEL + md)
+            blocks.append((row["code"], row["id"], header, md, tokens, version))
+        cursor.execute("DELETE FROM context_blocks")
+        cursor.executemany(
+            """
+            INSERT INTO context_blocks (code, syllabus_id, header, md, tokens, source_version)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            blocks,
+        )
+        conn.commit()
+    _fresh_version = version
+    return len(blocks)
+
+
+def get_context_blocks(codes: Iterable[str]) -> Dict[str, Dict]:
+    """科目コード → {header, md, tokens} を1回のクエリで取得（古ければ先に再構築）
+
+    context_blocks が未作成（init_database 前）の場合は空を返し、呼び出し側は
+    検索結果の講義情報・md から文脈を作る。
+    """
+    codes = list(dict.fromkeys(c for c in codes if c))
+    if not codes:
+        return {}
+    placeholders = ",".join("?" * len(codes))
+    try:
+        rebuild_context_blocks()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT code, header, md, tokens FROM context_blocks WHERE code IN ({placeholders})",
+                codes,
+            )
+            return {row["code"]: dict(row) for row in cursor.fetchall()}
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        return {}
+
+
+# ========================
+#  プロンプト用の文脈構築
+# ========================
+def build_rag_context(
+    results: List[Dict], max_tokens: Optional[int] = None
+) -> Tuple[str, Dict[str, int]]:
+    """検索結果（スコア順）を予算内に詰めたプロンプト用の文脈を作る
+
+    講義ヘッダとシラバス全文は context_blocks から科目コードで引く。
+    チャンク検索の結果のように md を持つ行は、その md をヘッダと組み合わせる。
+    同じ科目コードは最初（最上位）の1件のみ使う。各科目は
+    RAG_SECTION_MAX_TOKENS と残り予算の小さい方まで切り詰め、
+    RAG_SECTION_MIN_TOKENS 未満しか入らない科目は含めない。
+    戻り値: (文脈, 統計) 統計には最終的な推定トークン数・文字数を含む
+    """
+    max_tokens = max_tokens or RAG_CONTEXT_MAX_TOKENS
+    separator_tokens = estimate_tokens(SECTION_SEPARATOR)
+    blocks = get_context_blocks(row.get("code") for row in results)
+    seen = set()
+    sections = []
+    used = 0
+    stats = {"sections": 0, "duplicates": 0, "truncated": 0, "dropped": 0}
+    for row in results:
+        code = row.get("code")
+        if code in seen:
+            stats["duplicates"] += 1
+            continue
+        seen.add(code)
+
+        block = blocks.get(code)
+        header = block["header"] if block else _lecture_header(row.get("lecture"))
+        header += SECTION_BODY_LABEL
+        remaining = max_tokens - used - (separator_tokens if sections else 0)
+        section_budget = min(RAG_SECTION_MAX_TOKENS, remaining)
+        if "md" not in row and block is not None:
+            md = block["md"]
+            section_tokens = block["tokens"]
+        else:
+            md = row.get("md") or ""
+            section_tokens = estimate_tokens(header + md)
+        if section_tokens > section_budget:
+            md_budget = section_budget - estimate_tokens(header)
+            if md_budget < RAG_SECTION_MIN_TOKENS:
+                stats["dropped"] += 1
+                continue
+            md = truncate_to_tokens(md, md_budget)
+            section_tokens = estimate_tokens(header + md)
+            stats["truncated"] += 1
+
+        sections.append(header + md)
+        used += section_tokens + (separator_tokens if len(sections) > 1 else 0)
+
+    context = SECTION_SEPARATOR.join(sections)
+    stats.update(
+        sections=len(sections),
+        tokens=estimate_tokens(context),
+        chars=len(context),
+        max_tokens=max_tokens,
+    )
+    _record(stats)
+    return context, stats
+
+
+# ========================
+#  文脈サイズの統計
+# ========================
+_lock = threading.Lock()
+_totals = {
+    "contexts": 0,
+    "tokens": 0,
+    "max_tokens_seen": 0,
+    "last_tokens": 0,
+    "truncated_sections": 0,
+    "dropped_sections": 0,
+    "duplicate_sections": 0,
+}
+
+
+def _record(stats: Dict[str, int]):
+    with _lock:
+        _totals["contexts"] += 1
+        _totals["tokens"] += stats["tokens"]
+        _totals["max_tokens_seen"] = max(_totals["max_tokens_seen"], stats["tokens"])
+        _totals["last_tokens"] = stats["tokens"]
+        _totals["truncated_sections"] += stats["truncated"]
+        _totals["dropped_sections"] += stats["dropped"]
+        _totals["duplicate_sections"] += stats["duplicates"]
+
+
+def get_context_stats() -> Dict[str, float]:
+    """構築した文脈サイズの統計（推定トークン数）"""
+    with _lock:
+        totals = dict(_totals)
+    contexts = totals.pop("contexts")
+    tokens = totals.pop("tokens")
+    return {
+        "contexts": contexts,
+        "avg_tokens": tokens / contexts if contexts else 0.0,
+        **totals,
+        "budget_tokens": RAG_CONTEXT_MAX_TOKENS,
+    }
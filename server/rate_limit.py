@@ -0,0 +1,241 @@
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from fastapi import HTTPException
+
+# 外部API呼び出しの流量制御の設定
+# キューで待つ最大秒数（超えたら待たずに 503 を返す）
+UPSTREAM_MAX_WAIT = float(os.getenv("UPSTREAM_MAX_WAIT", "10"))
+# 連続失敗がこの回数に達したら回路を開き、一定時間呼び出しを止める
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+# Retry-After が無い場合に回路を開いておく秒数
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+# 再試行の待ち時間の上限（秒）
+RETRY_BACKOFF_CAP = float(os.getenv("RETRY_BACKOFF_CAP", "8"))
+
+
+def parse_retry_after(headers, body: Optional[str] = None) -> Optional[float]:
+    """Retry-After ヘッダ（秒数またはHTTP日付）か、Google APIの retryDelay から待ち秒数を得る"""
+    value = headers.get("Retry-After") if headers is not None else None
+    if value:
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    if body:
+        match = re.search(r'"retryDelay"\s*:\s*"([\d.]+)s"', body)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+# ========================
+#  外部APIごとの流量制御
+# ========================
+class UpstreamLimiter:
+    """トークンバケット + 同時実行数制限 + サーキットブレーカー
+
+    トークンは rate 個/秒で補充され、最大 burst 個まで貯まる。
+    同時に呼び出せるのは max_concurrency 件までで、待ちは max_wait 秒で打ち切る。
+    429 / 5xx / タイムアウトが続くか Retry-After を受け取ると回路を開き、
+    その間の呼び出しは上流に送らずすぐに失敗させる。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        max_wait: float = UPSTREAM_MAX_WAIT,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        cooldown: float = CIRCUIT_COOLDOWN,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self.waiting = 0
+        self.in_flight = 0
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.rejected = 0
+        self.circuit_rejections = 0
+        self.circuit_trips = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio のプリミティブはイベントループに紐づくため、ループが変わったら作り直す
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def _take_token(self) -> float:
+        """トークンを1つ取る。足りなければ取れるまでの秒数を返す（取れたら0）"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._refilled_at) * self.rate
+            )
+            self._refilled_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def _reject(self, detail: str, retry_after: Optional[float] = None):
+        headers = {"Retry-After": str(max(int(retry_after + 0.999), 1))}
+        raise HTTPException(status_code=503, detail=detail, headers=headers)
+
+    def _check_circuit(self):
+        remaining = self._open_until - time.monotonic()
+        if remaining > 0:
+            with self._lock:
+                self.circuit_rejections += 1
+            self._reject(
+                f"{self.name} APIが混雑しているため一時的に停止しています。しばらく時間をおいてから再試行してください。",
+                remaining,
+            )
+
+    @asynccontextmanager
+    async def slot(self):
+        """上流を1回呼び出す権利を得る（回路が開いている・待ちが長すぎる場合は 503）"""
+        self._check_circuit()
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        semaphore = self._get_semaphore()
+        with self._lock:
+            self.waiting += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.waiting)
+        acquired = False
+        try:
+            try:
+                await asyncio.wait_for(semaphore.acquire(), timeout=self.max_wait)
+                acquired = True
+            except asyncio.TimeoutError:
+                pass
+            while acquired:
+                delay = self._take_token()
+                if delay == 0:
+                    break
+                if time.monotonic() + delay > deadline:
+                    semaphore.release()
+                    acquired = False
+                    break
+                await asyncio.sleep(delay)
+        except BaseException:
+            if acquired:
+                semaphore.release()
+            raise
+        finally:
+            waited = time.monotonic() - started
+            with self._lock:
+                self.waiting -= 1
+                self.total_wait += waited
+                self.max_wait_seen = max(self.max_wait_seen, waited)
+                if acquired:
+                    self.acquired += 1
+                    self.in_flight += 1
+                else:
+                    self.rejected += 1
+        if not acquired:
+            self._reject(
+                f"{self.name} APIへのリクエストが混雑しています。しばらく時間をおいてから再試行してください。",
+                self.max_wait,
+            )
+        try:
+            # 待っている間に回路が開いた場合は送らない
+            self._check_circuit()
+            yield
+        finally:
+            semaphore.release()
+            with self._lock:
+                self.in_flight -= 1
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+
+    def record_failure(self, retry_after: Optional[float] = None):
+        """失敗を記録。Retry-After 指定時か連続失敗が閾値に達したら回路を開く"""
+        with self._lock:
+            self._consecutive_failures += 1
+            if (
+                retry_after is None
+                and self._consecutive_failures < self.failure_threshold
+            ):
+                return
+            wait = self.cooldown if retry_after is None else retry_after
+            open_until = time.monotonic() + wait
+            if open_until > self._open_until:
+                if self._open_until <= time.monotonic():
+                    self.circuit_trips += 1
+                self._open_until = open_until
+
+    def backoff(self, attempt: int) -> float:
+        """再試行までの待ち秒数（指数バックオフ + フルジッター）
+
+        回路が開いている場合は待たずに0を返し、次の slot() で即座に失敗させる。
+        """
+        if self._open_until > time.monotonic():
+            return 0.0
+        return random.uniform(0, min(RETRY_BACKOFF_CAP, 2**attempt))
+
+    def stats(self) -> Dict[str, float]:
+        """キューの深さ・待ち時間・回路の状態"""
+        with self._lock:
+            finished = self.acquired + self.rejected
+            remaining = max(self._open_until - time.monotonic(), 0.0)
+            return {
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "acquired": self.acquired,
+                "rejected": self.rejected,
+                "avg_wait_ms": self.total_wait / finished * 1000 if finished else 0.0,
+                "max_wait_ms": self.max_wait_seen * 1000,
+                "circuit_open": remaining > 0,
+                "circuit_open_seconds": remaining,
+                "circuit_trips": self.circuit_trips,
+                "circuit_rejections": self.circuit_rejections,
+            }
+
+
+gemini_limiter = UpstreamLimiter(
+    "Gemini",
+    rate=float(os.getenv("GEMINI_RATE_PER_SEC", "2")),
+    burst=int(os.getenv("GEMINI_BURST", "5")),
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+)
+cohere_limiter = UpstreamLimiter(
+    "Cohere",
+    rate=float(os.getenv("COHERE_RATE_PER_SEC", "10")),
+    burst=int(os.getenv("COHERE_BURST", "20")),
+    max_concurrency=int(os.getenv("COHERE_MAX_CONCURRENCY", "8")),
+)
+
+
+def get_upstream_stats() -> Dict[str, Dict[str, float]]:
+    return {"gemini": gemini_limiter.stats(), "cohere": cohere_limiter.stats()}
@@ -1,16 +1,38 @@
+import base64
 import json
 import os
 import re
 import httpx
 import asyncio
+import numpy as np
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
-from typing import Dict, Any, List
+from typing import AsyncIterator, Dict, Any, Iterable, Iterator, List, Optional
 from dotenv import load_dotenv
 from database import (
     search_lectures,
+    search_syllabuses_fulltext,
+    find_lecture_codes,
+    get_lectures_by_slot,
+    iter_all_users,
+    iter_lectures,
+    LECTURE_TEXT_COLUMNS,
     get_db_connection,
 )
+from vector_index import get_chunk_index, get_syllabus_index
+from embedding_cache import EmbeddingCache
+from answer_cache import ANSWER_CACHE_ENABLED, SemanticAnswerCache
+from http_client import get_http_client, get_http_client_stats
+from rag_context import build_rag_context, get_context_stats
+from async_db import run_db
+from singleflight import SingleFlight, request_key
+from rate_limit import (
+    CIRCUIT_COOLDOWN,
+    cohere_limiter,
+    gemini_limiter,
+    get_upstream_stats,
+    parse_retry_after,
+)
 
 
 # ========================
@@ -21,9 +43,40 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1alpha/models/gemini-2.5-flash:generateContent"
 GEMINI_API_URL_FAST = "https://generativelanguage.googleapis.com/v1alpha/models/gemini-2.5-flash:generateContent"
+GEMINI_STREAM_URL = "https://generativelanguage.googleapis.com/v1alpha/models/gemini-2.5-flash:streamGenerateContent"
+GEMINI_STREAM_URL_FAST = "https://generativelanguage.googleapis.com/v1alpha/models/gemini-2.5-flash:streamGenerateContent"
 
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 COHERE_API_URL = "https://api.cohere.com/v2/embed"
+COHERE_EMBED_MODEL = "embed-multilingual-v3.0"
+# 1回の埋め込みAPI呼び出しで送るテキスト数の上限（Cohereの制限）
+COHERE_EMBED_BATCH_SIZE = 96
+
+# RAG検索モード（リクエストで mode 未指定時の既定値）
+SEARCH_MODES = ("vector", "keyword", "hybrid")
+RAG_SEARCH_MODE = os.getenv("RAG_SEARCH_MODE", "vector")
+# ハイブリッド検索: RRFの定数kと、各方式から取る候補数の倍率
+HYBRID_RRF_K = 60
+HYBRID_CANDIDATE_FACTOR = 5
+# チャンク検索: "auto"（チャンクがあれば使う）/ "true" / "false"
+RAG_USE_CHUNKS = os.getenv("RAG_USE_CHUNKS", "auto")
+# 1シラバスあたりプロンプトに含めるチャンク数
+RAG_CHUNKS_PER_SYLLABUS = int(os.getenv("RAG_CHUNKS_PER_SYLLABUS", "3"))
+# 類似科目の一括検索で1リクエストに指定できるクエリ数の上限
+SIMILAR_SEARCH_MAX_QUERIES = int(os.getenv("SIMILAR_SEARCH_MAX_QUERIES", "100"))
+# 講義一覧のページ取得: limit 未指定時の件数と上限
+LECTURE_PAGE_DEFAULT_LIMIT = 50
+LECTURE_PAGE_MAX_LIMIT = int(os.getenv("LECTURE_PAGE_MAX_LIMIT", "200"))
+# 会話の検索クエリ: 直近何件のユーザー発言を使うかと、1件さかのぼるごとの重みの減衰率
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "8"))
+CHAT_HISTORY_DECAY = float(os.getenv("CHAT_HISTORY_DECAY", "0.5"))
+
+# 同じ質問ではCohereを呼ばずに済むよう、クエリ埋め込みをキャッシュする
+query_embedding_cache = EmbeddingCache(namespace=f"{COHERE_EMBED_MODEL}:search_query")
+# 似た質問で検索結果も同じならGeminiを呼ばずに回答を返す
+answer_cache = SemanticAnswerCache()
+# 同時に届いた同一のチャット・ページ生成リクエストは上流呼び出しを1回にまとめる
+inflight = SingleFlight()
 
 
 # ========================
@@ -36,42 +89,381 @@ def init_database_service():
 
 
 # ========================
-#  講義情報取得関数（code指定）
+#  ベクトル検索 (BLOB型vectorカラム)
 # ========================
-def get_lecture_by_code(code: str):
-    """codeに基づいて講義情報を取得（複数の場合は最初の一件）"""
+def fetch_syllabus_details(hits: List[Dict], include_md: bool = True) -> List[Dict]:
+    """検索の取得フェーズ: 上位k件のmdと講義情報を1回の IN (...) クエリで取得
+
+    スコア計算フェーズ（ベクトル索引）では id とベクトルしか扱わないため、
+    md を読むのは勝ち残った行だけで済む。チャンク検索の結果など、
+    既に md を持つ行は md を読まずに講義情報だけを付与する。
+    include_md=False の場合は講義情報のみを付与する。
+    """
+    ids = [
+        hit["id"]
+        for hit in hits
+        if (include_md and "md" not in hit) or "lecture" not in hit
+    ]
+    if not ids:
+        return hits
+    md_ids = [hit["id"] for hit in hits if include_md and "md" not in hit]
+    placeholders = ",".join("?" * len(ids))
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT name, lecturer, grade, class_name, time FROM lectures WHERE code = ? LIMIT 1",
-            (code,),
+            f"""
+            SELECT
+                s.id,
+                CASE WHEN s.id IN (SELECT value FROM json_each(?)) THEN s.md END AS md,
+                l.id AS lecture_id,
+                l.name,
+                l.lecturer,
+                l.grade,
+                l.class_name,
+                l.time
+            FROM syllabuses s
+            LEFT JOIN lectures l ON l.id = (
+                SELECT id FROM lectures WHERE code = s.code ORDER BY id LIMIT 1
+            )
+            WHERE s.id IN ({placeholders})
+            """,
+            [json.dumps(md_ids), *ids],
         )
-        row = cursor.fetchone()
-        return row
+        rows = {row["id"]: row for row in cursor.fetchall()}
+
+    results = []
+    for hit in hits:
+        if (not include_md or "md" in hit) and "lecture" in hit:
+            results.append(hit)
+            continue
+        row = rows.get(hit["id"])
+        result = dict(hit)
+        if include_md and "md" not in result:
+            result["md"] = (row["md"] if row else None) or ""
+        result["lecture"] = (
+            {
+                "name": row["name"],
+                "lecturer": row["lecturer"],
+                "grade": row["grade"],
+                "class_name": row["class_name"],
+                "time": row["time"],
+            }
+            if row and row["lecture_id"] is not None
+            else None
+        )
+        results.append(result)
+    return results
+
+
+def search_similar_syllabuses(
+    query_vector: List[float],
+    top_k: int = 10,
+    nprobe: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    details: bool = True,
+):
+    """常駐ベクトル索引で上位k件を求め、該当行のmdのみをDBから取得
+
+    nprobe: 近似索引(IVF)で走査するクラスタ数。大きいほど再現率が上がる
+    filters: 講義の絞り込み条件（season, day, period, grade, category, class_name）。
+        先に lectures から科目コードを求め、その行だけを走査する
+    details: False の場合は md・講義情報を取得せず {id, code, similarity} のみ返す
+        （チャットでは context_blocks から文脈を引くため不要）
+    """
+    codes = find_lecture_codes(filters) if filters else None
+    hits = get_syllabus_index().search(
+        query_vector, top_k=top_k, nprobe=nprobe, candidate_codes=codes
+    )
+    return fetch_syllabus_details(hits) if details else hits
 
 
 # ========================
-#  ベクトル検索 (BLOB型vectorカラム)
+#  チャンク単位のベクトル検索
 # ========================
-def search_similar_syllabuses(query_vector: List[float], top_k: int = 10):
+def use_chunk_retrieval() -> bool:
+    """チャンク索引を使うか（RAG_USE_CHUNKS=auto ならチャンクが存在する場合のみ）"""
+    if RAG_USE_CHUNKS == "auto":
+        index = get_chunk_index()
+        index.refresh()
+        return len(index) > 0
+    return RAG_USE_CHUNKS == "true"
+
+
+def search_similar_chunks(
+    query_vector: List[float],
+    top_k: int = 10,
+    chunks_per_syllabus: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    details: bool = True,
+) -> List[Dict]:
+    """チャンク索引で検索し、シラバス単位にまとめて上位k件を返す
+
+    各シラバスは最も類似度の高いチャンクのスコアで順位付けし、
+    md には上位 chunks_per_syllabus 件のチャンクのみを文書順で連結する。
+    """
+    chunks_per_syllabus = chunks_per_syllabus or RAG_CHUNKS_PER_SYLLABUS
+    codes = find_lecture_codes(filters) if filters else None
+    hits = get_chunk_index().search(
+        query_vector,
+        top_k=top_k * chunks_per_syllabus * 2,
+        candidate_codes=codes,
+    )
+    if not hits:
+        return []
+    ids = [hit["id"] for hit in hits]
+    placeholders = ",".join("?" * len(ids))
     with get_db_connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT code, md, vector FROM syllabuses")
-        rows = cursor.fetchall()
+        cursor.execute(
+            f"""
+            SELECT id, syllabus_id, chunk_index, heading, text
+            FROM syllabus_chunks WHERE id IN ({placeholders})
+            """,
+            ids,
+        )
+        chunk_by_id = {row["id"]: row for row in cursor.fetchall()}
+
+    grouped: Dict[int, Dict] = {}
+    for hit in hits:
+        chunk = chunk_by_id.get(hit["id"])
+        if chunk is None:
+            continue
+        group = grouped.get(chunk["syllabus_id"])
+        if group is None:
+            if len(grouped) >= top_k:
+                continue
+            group = grouped[chunk["syllabus_id"]] = {
+                "id": chunk["syllabus_id"],
+                "code": hit["code"],
+                "similarity": hit["similarity"],
+                "chunks": [],
+            }
+        if len(group["chunks"]) < chunks_per_syllabus:
+            group["chunks"].append(chunk)
+
     results = []
-    for row in rows:
-        code, md, vector_bytes = row
-        syllabus_vector = bytes_to_float_list(vector_bytes)
-        similarity = cosine_similarity(query_vector, syllabus_vector)
-        results.append({"code": code, "md": md, "similarity": similarity})
-    # 類似度降順でTOP K
-    results.sort(key=lambda x: x["similarity"], reverse=True)
-    return results[:top_k]
+    for group in grouped.values():
+        chunks = sorted(group.pop("chunks"), key=lambda c: c["chunk_index"])
+        group["md"] = "\n\n".join(
+            f"## {c['heading']}\n{c['text']}" if c["heading"] else c["text"]
+            for c in chunks
+        )
+        results.append(group)
+    return fetch_syllabus_details(results) if details else results
+
+
+# ========================
+#  ハイブリッド検索 (BM25 + ベクトル)
+# ========================
+def search_syllabuses_hybrid(
+    query_vector: List[float],
+    query: str,
+    top_k: int = 10,
+    filters: Optional[Dict[str, Any]] = None,
+    details: bool = True,
+) -> List[Dict]:
+    """全文検索(BM25)とベクトル検索の順位を Reciprocal Rank Fusion で統合
+
+    各方式で top_k * HYBRID_CANDIDATE_FACTOR 件を取り、
+    score = Σ 1 / (HYBRID_RRF_K + 順位) の降順で上位k件を返す。
+    """
+    n_candidates = top_k * HYBRID_CANDIDATE_FACTOR
+    codes = find_lecture_codes(filters) if filters else None
+    if use_chunk_retrieval():
+        vector_ranking = search_similar_chunks(
+            query_vector, top_k=n_candidates, filters=filters, details=details
+        )
+    else:
+        vector_ranking = get_syllabus_index().search(
+            query_vector, top_k=n_candidates, candidate_codes=codes
+        )
+    rankings = [
+        vector_ranking,
+        search_syllabuses_fulltext(query, limit=n_candidates, codes=codes),
+    ]
+    fused: Dict[int, Dict] = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking, start=1):
+            entry = fused.setdefault(
+                hit["id"],
+                {"id": hit["id"], "code": hit["code"], "similarity": 0.0, "score": 0.0},
+            )
+            entry["score"] += 1.0 / (HYBRID_RRF_K + rank)
+            if "similarity" in hit:
+                entry["similarity"] = hit["similarity"]
+            for key in ("md", "lecture"):
+                if key in hit:
+                    entry[key] = hit[key]
+    hits = sorted(fused.values(), key=lambda x: x["score"], reverse=True)[:top_k]
+    return fetch_syllabus_details(hits) if details else hits
+
+
+async def retrieve_syllabuses(
+    query: str,
+    mode: Optional[str] = None,
+    top_k: int = 10,
+    filters: Optional[Dict[str, Any]] = None,
+    details: bool = True,
+    query_vector: Optional[List[float]] = None,
+) -> List[Dict]:
+    """検索モードに応じてシラバスを取得
+
+    mode: "vector"（埋め込みのみ）/ "keyword"（FTS5のみ）/ "hybrid"（RRFで統合）
+    filters: 講義の絞り込み条件（search_similar_syllabuses を参照）
+    details: 各結果に md・講義情報を付与するか（search_similar_syllabuses を参照）
+    query_vector: 指定時は query を埋め込まずにこのベクトルで検索する
+    """
+    mode = mode or RAG_SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"未対応の検索モードです: {mode}")
+    if mode == "keyword":
+        return await run_db(
+            _search_keyword, query, top_k=top_k, filters=filters, details=details
+        )
+    if query_vector is None:
+        query_vector = await get_embedding_with_cohere(query)
+    if mode == "hybrid":
+        return await run_db(
+            search_syllabuses_hybrid,
+            query_vector,
+            query,
+            top_k=top_k,
+            filters=filters,
+            details=details,
+        )
+    return await run_db(
+        _search_vector, query_vector, top_k=top_k, filters=filters, details=details
+    )
+
+
+def _search_keyword(
+    query: str,
+    top_k: int,
+    filters: Optional[Dict[str, Any]] = None,
+    details: bool = True,
+) -> List[Dict]:
+    codes = find_lecture_codes(filters) if filters else None
+    hits = search_syllabuses_fulltext(query, limit=top_k, codes=codes)
+    return fetch_syllabus_details(hits) if details else hits
+
+
+def _search_vector(
+    query_vector: List[float],
+    top_k: int,
+    filters: Optional[Dict[str, Any]] = None,
+    details: bool = True,
+) -> List[Dict]:
+    if use_chunk_retrieval():
+        return search_similar_chunks(
+            query_vector, top_k=top_k, filters=filters, details=details
+        )
+    return search_similar_syllabuses(
+        query_vector, top_k=top_k, filters=filters, details=details
+    )
+
+
+# ========================
+#  類似科目の一括検索
+# ========================
+async def search_similar_batch(
+    texts: Optional[List[str]] = None,
+    codes: Optional[List[str]] = None,
+    top_k: int = 10,
+    filters: Optional[Dict[str, Any]] = None,
+) -> List[Dict]:
+    """複数のクエリ文・科目コードそれぞれの類似シラバス上位k件を返す
+
+    クエリ文は1回の Cohere 呼び出しでまとめて埋め込み、科目コードは登録済みの
+    シラバスベクトルをそのままクエリにする。全クエリのスコアは行列積1回で計算し、
+    講義情報も全結果分を1回のクエリで取得する。科目コード自身は結果から除く。
+    """
+    texts = texts or []
+    codes = codes or []
+    if not texts and not codes:
+        raise HTTPException(status_code=400, detail="texts か codes を指定してください")
+    if len(texts) + len(codes) > SIMILAR_SEARCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"クエリは{SIMILAR_SEARCH_MAX_QUERIES}件までです",
+        )
+
+    queries = [{"type": "text", "query": text} for text in texts]
+    vectors = list(await get_embeddings_with_cohere(texts)) if texts else []
+    return await run_db(_search_similar_batch, queries, vectors, codes, top_k, filters)
+
+
+def _search_similar_batch(
+    queries: List[Dict],
+    vectors: List[List[float]],
+    codes: List[str],
+    top_k: int,
+    filters: Optional[Dict[str, Any]],
+) -> List[Dict]:
+    index = get_syllabus_index()
+    code_vectors = index.vectors_for_codes(codes)
+    for code in codes:
+        queries.append({"type": "code", "query": code})
+        # ベクトルの無い科目コードはゼロベクトル（結果なし）として扱う
+        vectors.append(code_vectors.get(code))
+
+    dim = next((len(v) for v in vectors if v is not None), 0)
+    matrix = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, vector in enumerate(vectors):
+        if vector is not None and len(vector) == dim:
+            matrix[i] = vector
+
+    candidate_codes = find_lecture_codes(filters) if filters else None
+    # 科目コードのクエリは自身が1位になるので1件多く取る
+    hit_lists = index.search_batch(
+        matrix, top_k=top_k + (1 if codes else 0), candidate_codes=candidate_codes
+    )
+    for query, hits in zip(queries, hit_lists):
+        if query["type"] == "code":
+            hits = [hit for hit in hits if hit["code"] != query["query"]]
+        query["hits"] = hits[:top_k]
+
+    unique_hits = {hit["id"]: hit for query in queries for hit in query["hits"]}
+    details = {
+        row["id"]: row
+        for row in fetch_syllabus_details(list(unique_hits.values()), include_md=False)
+    }
+    for query in queries:
+        query["results"] = [
+            {**details[hit["id"]], "similarity": hit["similarity"]}
+            for hit in query.pop("hits")
+        ]
+    return queries
 
 
 # ========================
 #  Gemini API 共通ユーティリティ
 # ========================
+def _raise_gemini_error(resp: httpx.Response, body: str):
+    """Geminiのエラー応答を記録して HTTPException にする（429 は Retry-After を伝える）"""
+    try:
+        detail = json.loads(body).get("error", {}).get("message", "")
+    except Exception:
+        detail = body[:200]
+    if (
+        resp.status_code == 429
+        or "quota" in detail.lower()
+        or "limit" in detail.lower()
+    ):
+        retry_after = parse_retry_after(resp.headers, body)
+        gemini_limiter.record_failure(retry_after)
+        raise HTTPException(
+            status_code=429,
+            detail="Gemini APIの使用量制限に達しました。しばらく時間をおいてから再試行してください。",
+            headers={"Retry-After": str(int(retry_after or CIRCUIT_COOLDOWN))},
+        )
+    if resp.status_code >= 500:
+        gemini_limiter.record_failure(parse_retry_after(resp.headers))
+    raise HTTPException(
+        status_code=500,
+        detail=f"Gemini API Error: {resp.status_code} - {detail}",
+    )
+
+
 async def _post_to_gemini(
     payload: Dict[str, Any], max_retries: int = 3, fast: bool = False
 ) -> Dict[str, Any]:
@@ -84,7 +476,8 @@ async def _post_to_gemini(
 
     for attempt in range(max_retries):
         try:
-            async with httpx.AsyncClient() as client:
+            async with gemini_limiter.slot():
+                client = get_http_client()
                 resp = await client.post(
                     url,
                     headers={"Content-Type": "application/json"},
@@ -93,28 +486,13 @@ async def _post_to_gemini(
                 )
 
             if resp.status_code != 200:
-                try:
-                    error_data = resp.json()
-                    detail = error_data.get("error", {}).get("message", "")
-                    if (
-                        resp.status_code == 429
-                        or "quota" in detail.lower()
-                        or "limit" in detail.lower()
-                    ):
-                        raise HTTPException(
-                            status_code=429,
-                            detail="Gemini APIの使用量制限に達しました。しばらく時間をおいてから再試行してください。",
-                        )
-                except Exception:
-                    detail = resp.text[:200]
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Gemini API Error: {resp.status_code} - {detail}",
-                )
+                _raise_gemini_error(resp, resp.text)
+            gemini_limiter.record_success()
             return resp.json()
         except httpx.TimeoutException:
+            gemini_limiter.record_failure()
             if attempt < max_retries - 1:
-                await asyncio.sleep(2**attempt)
+                await asyncio.sleep(gemini_limiter.backoff(attempt))
                 continue
             else:
                 raise HTTPException(
@@ -122,8 +500,9 @@ async def _post_to_gemini(
                     detail=f"Gemini API がタイムアウトしました（{max_retries}回試行後）。しばらく時間をおいてから再試行してください。",
                 )
         except httpx.RequestError as e:
+            gemini_limiter.record_failure()
             if attempt < max_retries - 1:
-                await asyncio.sleep(2**attempt)
+                await asyncio.sleep(gemini_limiter.backoff(attempt))
                 continue
             else:
                 raise HTTPException(
@@ -131,6 +510,71 @@ async def _post_to_gemini(
                 )
 
 
+async def _stream_gemini(
+    payload: Dict[str, Any], max_retries: int = 3, fast: bool = False
+) -> AsyncIterator[str]:
+    """streamGenerateContent (alt=sse) を逐次読み、テキスト断片を届いた順に返す
+
+    再試行は最初の断片を返す前のタイムアウト・接続エラーに限る
+    （途中まで返した回答を最初から繰り返さないため）。
+    同時実行枠は応答を読み終えるまで保持する。
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500, detail="GEMINI_API_KEY が設定されていません"
+        )
+
+    url = f"{GEMINI_STREAM_URL_FAST if fast else GEMINI_STREAM_URL}?alt=sse&key={GEMINI_API_KEY}"
+
+    for attempt in range(max_retries):
+        started = False
+        try:
+            async with gemini_limiter.slot():
+                client = get_http_client()
+                async with client.stream(
+                    "POST",
+                    url,
+                    headers={"Content-Type": "application/json"},
+                    json=payload,
+                    timeout=httpx.Timeout(60.0, connect=10.0),
+                ) as resp:
+                    if resp.status_code != 200:
+                        body = (await resp.aread()).decode("utf-8", "replace")
+                        _raise_gemini_error(resp, body)
+                    gemini_limiter.record_success()
+                    async for line in resp.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        try:
+                            event = json.loads(line[5:].strip())
+                            parts = event["candidates"][0]["content"]["parts"]
+                        except (json.JSONDecodeError, KeyError, IndexError):
+                            continue
+                        for part in parts:
+                            text = part.get("text")
+                            if text:
+                                started = True
+                                yield text
+            return
+        except httpx.TimeoutException:
+            gemini_limiter.record_failure()
+            if not started and attempt < max_retries - 1:
+                await asyncio.sleep(gemini_limiter.backoff(attempt))
+                continue
+            raise HTTPException(
+                status_code=504,
+                detail="Gemini API がタイムアウトしました。しばらく時間をおいてから再試行してください。",
+            )
+        except httpx.RequestError as e:
+            gemini_limiter.record_failure()
+            if not started and attempt < max_retries - 1:
+                await asyncio.sleep(gemini_limiter.backoff(attempt))
+                continue
+            raise HTTPException(
+                status_code=503, detail=f"Gemini API への接続エラー: {str(e)}"
+            )
+
+
 def _extract_json(raw: str) -> str:
     raw = raw.strip()
     if raw.startswith("```"):
@@ -147,6 +591,14 @@ def _extract_json(raw: str) -> str:
 #  構造化出力 (JSON) でページを生成
 # ========================
 async def generate_page_with_ai(prompt: str) -> Dict[str, str]:
+    """同じ要求が生成中ならその結果を共有する（single-flight）"""
+    page = await inflight.do(
+        request_key("generate_page", prompt), lambda: _generate_page(prompt)
+    )
+    return dict(page)
+
+
+async def _generate_page(prompt: str) -> Dict[str, str]:
     system_prompt = f"""
 以下の要求に基づいて **JSON 形式のみ** で美しい Web ページを生成してください。マークダウンや追加説明は不要です。
 
@@ -190,6 +642,32 @@ async def generate_page_with_ai(prompt: str) -> Dict[str, str]:
 # ========================
 #  講義検索API
 # ========================
+def _encode_lecture_cursor(last_id: int) -> str:
+    raw = json.dumps({"after": last_id}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_lecture_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded))["after"])
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor が不正です")
+
+
+def _parse_lecture_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """fields=name,time のような列指定を検証して列名のリストにする（id は常に含める）"""
+    if not fields:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f != "id" and f not in LECTURE_TEXT_COLUMNS]
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"未対応の項目です: {', '.join(unknown)}"
+        )
+    return list(dict.fromkeys(["id", *names]))
+
+
 def get_lectures_service(
     title=None,
     category=None,
@@ -201,8 +679,19 @@ def get_lectures_service(
     season=None,
     time=None,
     keyword=None,
+    limit=None,
+    cursor=None,
+    fields=None,
 ):
-    return search_lectures(
+    """講義を検索
+
+    limit か cursor を指定するとページ単位で返す:
+        {"items": [...], "next_cursor": 次ページのcursor（無ければNone）, "has_more": bool}
+    件数は数えず、limit + 1 件目の有無で続きがあるかを判定する。
+    未指定の場合は従来どおり該当する全件のリストを返す。
+    fields: "name,time" のように返す項目を絞る（id は常に含む）
+    """
+    filters = dict(
         title=title,
         category=category,
         code=code,
@@ -214,6 +703,55 @@ def get_lectures_service(
         time=time,
         keyword=keyword,
     )
+    columns = _parse_lecture_fields(fields)
+    if limit is None and cursor is None:
+        return search_lectures(**filters, fields=columns)
+
+    try:
+        limit = int(limit) if limit is not None else LECTURE_PAGE_DEFAULT_LIMIT
+    except ValueError:
+        raise HTTPException(status_code=400, detail="limit は整数で指定してください")
+    if not 1 <= limit <= LECTURE_PAGE_MAX_LIMIT:
+        raise HTTPException(
+            status_code=400,
+            detail=f"limit は1〜{LECTURE_PAGE_MAX_LIMIT}で指定してください",
+        )
+    after_id = _decode_lecture_cursor(cursor) if cursor else None
+    rows = search_lectures(
+        **filters, fields=columns, after_id=after_id, limit=limit + 1
+    )
+    has_more = len(rows) > limit
+    items = rows[:limit]
+    return {
+        "items": items,
+        "next_cursor": _encode_lecture_cursor(items[-1]["id"]) if has_more else None,
+        "has_more": has_more,
+    }
+
+
+# ========================
+#  NDJSONストリーミング
+# ========================
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def format_ndjson(rows: Iterable[Dict]) -> Iterator[str]:
+    """1行1JSONに変換しながら返す（rows を先に全件読み込まない）"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def stream_lectures_service(keyword=None, fields=None, **filters) -> Iterator[str]:
+    """get_lectures_service と同じ条件の講義を id 順に NDJSON で返す
+
+    項目指定の検証は応答を始める前（この関数の呼び出し時）に行う。
+    """
+    columns = _parse_lecture_fields(fields)
+    return format_ndjson(iter_lectures(keyword=keyword, fields=columns, **filters))
+
+
+def stream_users_service() -> Iterator[str]:
+    return format_ndjson(iter_all_users())
 
 
 # ========================
@@ -235,56 +773,120 @@ def get_syllabus_html_service(code: str):
 #  Cohere で埋め込み生成
 # ========================
 async def get_embedding_with_cohere(text: str) -> List[float]:
+    return (await get_embeddings_with_cohere([text]))[0]
+
+
+async def get_embeddings_with_cohere(texts: List[str]) -> List[List[float]]:
+    """複数テキストの埋め込みを取得（キャッシュに無いものだけを1回のAPI呼び出しで生成）"""
     if not COHERE_API_KEY:
         raise HTTPException(
             status_code=500, detail="COHERE_API_KEY が設定されていません"
         )
 
-    async def _embed():
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                COHERE_API_URL,
-                headers={
-                    "Authorization": f"Bearer {COHERE_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "model": "embed-multilingual-v3.0",
-                    "input_type": "search_query",
-                    "texts": [text],
-                    "truncate": "END",
-                },
-                timeout=30,
+    embeddings: List[Optional[List[float]]] = await run_db(
+        lambda: [query_embedding_cache.get(text) for text in texts]
+    )
+    missing = list(
+        dict.fromkeys(text for text, e in zip(texts, embeddings) if e is None)
+    )
+    if not missing:
+        return embeddings
+
+    async def _embed(batch: List[str]) -> List[List[float]]:
+        try:
+            async with cohere_limiter.slot():
+                client = get_http_client()
+                resp = await client.post(
+                    COHERE_API_URL,
+                    headers={
+                        "Authorization": f"Bearer {COHERE_API_KEY}",
+                        "Content-Type": "application/json",
+                    },
+                    json={
+                        "model": COHERE_EMBED_MODEL,
+                        "input_type": "search_query",
+                        "texts": batch,
+                        "truncate": "END",
+                    },
+                    timeout=30,
+                )
+        except httpx.TimeoutException:
+            # タイムアウトが続く障害でも回路が開くよう失敗として記録する
+            cohere_limiter.record_failure()
+            raise HTTPException(
+                status_code=504,
+                detail="Cohere API がタイムアウトしました。しばらく時間をおいてから再試行してください。",
+            )
+        except httpx.RequestError as e:
+            cohere_limiter.record_failure()
+            raise HTTPException(
+                status_code=503, detail=f"Cohere API への接続エラー: {str(e)}"
             )
-            if resp.status_code == 200:
-                data = resp.json()
-                if "embeddings" in data:
-                    embeddings = data["embeddings"]
-                    if "float" in embeddings:
-                        return [float(x) for x in embeddings["float"][0]]
-                    else:
-                        return [float(x) for x in embeddings[0]]
-                elif "embeddings_by_type" in data:
-                    embeddings_by_type = data["embeddings_by_type"]
-                    first_key = list(embeddings_by_type.keys())[0]
-                    return [float(x) for x in embeddings_by_type[first_key][0]]
+        if resp.status_code == 429 or resp.status_code >= 500:
+            retry_after = parse_retry_after(resp.headers)
+            cohere_limiter.record_failure(retry_after)
+            if resp.status_code == 429:
+                raise HTTPException(
+                    status_code=429,
+                    detail="Cohere APIの使用量制限に達しました。しばらく時間をおいてから再試行してください。",
+                    headers={"Retry-After": str(int(retry_after or CIRCUIT_COOLDOWN))},
+                )
+        if resp.status_code == 200:
+            cohere_limiter.record_success()
+            data = resp.json()
+            if "embeddings" in data:
+                embeddings = data["embeddings"]
+                if "float" in embeddings:
+                    vectors = embeddings["float"]
                 else:
-                    raise Exception(f"予期しないレスポンス構造: {data}")
+                    vectors = embeddings
+            elif "embeddings_by_type" in data:
+                embeddings_by_type = data["embeddings_by_type"]
+                first_key = list(embeddings_by_type.keys())[0]
+                vectors = embeddings_by_type[first_key]
             else:
-                raise Exception(f"Cohere APIエラー: {resp.status_code} - {resp.text}")
+                raise Exception(f"予期しないレスポンス構造: {data}")
+            return [[float(x) for x in vector] for vector in vectors]
+        else:
+            raise Exception(f"Cohere APIエラー: {resp.status_code} - {resp.text}")
 
+    generated: Dict[str, List[float]] = {}
     try:
-        return await _embed()
+        for start in range(0, len(missing), COHERE_EMBED_BATCH_SIZE):
+            batch = missing[start : start + COHERE_EMBED_BATCH_SIZE]
+            generated.update(zip(batch, await _embed(batch)))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Cohere埋め込み生成失敗: {str(e)}")
+    await run_db(
+        lambda: [query_embedding_cache.put(t, e) for t, e in generated.items()]
+    )
+    return [
+        e if e is not None else generated[text] for text, e in zip(texts, embeddings)
+    ]
+
+
+# ========================
+#  内部統計
+# ========================
+def get_metrics_service() -> Dict[str, Any]:
+    return {
+        "query_embedding_cache": query_embedding_cache.stats(),
+        "http_client": get_http_client_stats(),
+        "answer_cache": answer_cache.stats(),
+        "rag_context": get_context_stats(),
+        "upstream": get_upstream_stats(),
+        "inflight": inflight.stats(),
+    }
 
 
 # ========================
 #  Gemini QA用（文章のみ返す）
 # ========================
-async def generate_answer_with_ai(
-    prompt: str, messages: List[Dict[str, str]] = None, fast: bool = False
-) -> str:
+def _build_answer_payload(
+    prompt: str, messages: List[Dict[str, str]] = None
+) -> Dict[str, Any]:
     contents = []
     if messages:
         for msg in messages:
@@ -314,12 +916,18 @@ async def generate_answer_with_ai(
 {prompt}
 """
     contents.append({"role": "user", "parts": [{"text": system_prompt}]})
-    payload = {
+    return {
         "contents": contents,
         "generationConfig": {
             "response_mime_type": "text/plain",
         },
     }
+
+
+async def generate_answer_with_ai(
+    prompt: str, messages: List[Dict[str, str]] = None, fast: bool = False
+) -> str:
+    payload = _build_answer_payload(prompt, messages)
     result = await _post_to_gemini(payload, fast=fast)
     try:
         return result["candidates"][0]["content"]["parts"][0]["text"]
@@ -329,30 +937,99 @@ async def generate_answer_with_ai(
         ) from e
 
 
+async def stream_answer_with_ai(
+    prompt: str, messages: List[Dict[str, str]] = None, fast: bool = False
+) -> AsyncIterator[str]:
+    """generate_answer_with_ai のストリーミング版（生成された断片を順に返す）"""
+    async for text in _stream_gemini(
+        _build_answer_payload(prompt, messages), fast=fast
+    ):
+        yield text
+
+
 # ========================
 #  チャットAPIサービス
 # ========================
-async def chat_service(request):
+def format_sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Server-Sent Events の1イベント分の文字列を作る"""
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def sse_events(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """テキスト断片を SSE に変換（data: {"text": ...}、終了時 event: done）
+
+    ヘッダ送信後はステータスコードを変えられないため、
+    途中のエラーは event: error として送る。
+    """
+    try:
+        async for chunk in chunks:
+            yield format_sse({"text": chunk})
+    except HTTPException as e:
+        yield format_sse({"status": e.status_code, "detail": e.detail}, event="error")
+        return
+    except Exception as e:
+        yield format_sse({"status": 500, "detail": str(e)}, event="error")
+        return
+    yield format_sse({}, event="done")
+
+
+async def _answer_cache_vector(
+    question: str, messages: List[Dict[str, str]], mode: Optional[str]
+) -> Optional[List[float]]:
+    """回答キャッシュのキーに使う質問埋め込み（キャッシュ対象外ならNone）
+
+    会話履歴によって回答が変わるため、対象は質問1件だけのリクエストに限る。
+    埋め込みは検索時にクエリ埋め込みキャッシュへ入っているのでAPI呼び出しは増えない。
+    """
+    if not ANSWER_CACHE_ENABLED or (mode or RAG_SEARCH_MODE) == "keyword":
+        return None
+    if any(m["content"] != question for m in messages):
+        return None
+    return await get_embedding_with_cohere(question)
+
+
+async def _answer_with_cache(
+    prompt: str,
+    messages: List[Dict[str, str]],
+    vector: Optional[List[float]],
+    results: List[Dict],
+) -> AsyncIterator[str]:
+    """回答キャッシュにあれば保存済みの回答を、無ければ生成しながら返して保存する"""
+    codes = [row["code"] for row in results]
+    if vector is not None:
+        cached = await run_db(answer_cache.get, vector, codes)
+        if cached is not None:
+            yield cached
+            return
+    parts = []
+    async for chunk in stream_answer_with_ai(prompt, messages, fast=True):
+        parts.append(chunk)
+        yield chunk
+    if vector is not None:
+        await run_db(answer_cache.put, vector, codes, "".join(parts))
+
+
+def _chat_key(namespace: str, request: Dict[str, Any]) -> str:
+    return request_key(
+        namespace,
+        {k: request.get(k) for k in ("question", "messages", "mode", "filters")},
+    )
+
+
+async def _prepare_chat(request: Dict[str, Any]):
     question = request["question"]
     messages = request.get("messages", [])
-    query_vector = await get_embedding_with_cohere(question)
-    results = search_similar_syllabuses(query_vector, top_k=10)
-    context_parts = []
-    for row in results:
-        code = row["code"]
-        md = row["md"]
-        lecture_info = get_lecture_by_code(code)
-        if lecture_info:
-            lecture_details = f"""
-講義名: {lecture_info["name"] or "情報なし"}
-講師: {lecture_info["lecturer"] or "情報なし"}
-学年: {lecture_info["grade"] or "情報なし"}
-曜日・校時: {lecture_info["time"] or "情報なし"}
-"""
-        else:
-            lecture_details = "講義情報: 該当なし"
-        context_parts.append(f"{lecture_details}\n\nシラバス内容:\n{md}")
-    context = "\n\n---\n\n".join(context_parts)
+    results = await retrieve_syllabuses(
+        question,
+        mode=request.get("mode"),
+        top_k=10,
+        filters=request.get("filters"),
+        details=False,
+    )
+    vector = await _answer_cache_vector(question, messages, request.get("mode"))
+    context, _ = await run_db(build_rag_context, results)
     prompt = f"""
 # シラバス情報
 {context}
@@ -360,67 +1037,71 @@ async def chat_service(request):
 # ユーザーの質問
 {question}
 """
-    answer = await generate_answer_with_ai(prompt, messages, fast=True)
+    return prompt, messages, vector, results
 
-    async def gen():
-        import re, asyncio
 
-        for sentence in re.split(r"(。|！|!|\?|？)", answer):
-            if sentence.strip():
-                yield sentence
-                await asyncio.sleep(0.05)
+async def chat_service(request):
+    """検索（埋め込み含む）と回答生成を、同時に届いた同一リクエスト間で共有する
 
-    return gen()
+    検索エラーは呼び出し元に例外として返し、回答は合流した全員に同じストリームを配る。
+    """
+    key = _chat_key("chat", request)
+    prompt, messages, vector, results = await inflight.do(
+        f"{key}:prepare", lambda: _prepare_chat(request)
+    )
+    return inflight.stream(
+        key, lambda: _answer_with_cache(prompt, messages, vector, results)
+    )
 
 
-async def chat_service_stream(data):
+async def conversation_vector(user_texts: List[str]) -> List[float]:
+    """ユーザー発言ごとの埋め込みを新しいものほど重くして合成した検索ベクトル
+
+    発言単位で埋め込むので、クエリ埋め込みキャッシュにより各ターンで新たに
+    埋め込むのは最新の発言だけになる。使う発言は直近 CHAT_HISTORY_MAX_MESSAGES 件。
+    """
+    user_texts = user_texts[-CHAT_HISTORY_MAX_MESSAGES:]
+    vectors = np.asarray(await get_embeddings_with_cohere(user_texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    weights = CHAT_HISTORY_DECAY ** np.arange(len(user_texts) - 1, -1, -1)
+    combined = weights @ vectors
+    norm = np.linalg.norm(combined)
+    return (combined / norm if norm else combined).tolist()
+
+
+async def _chat_stream_chunks(data):
     messages = data.get("messages", [])
-    # ユーザー側のメッセージをすべて連結
-    user_text = "\n".join([m["content"] for m in messages if m["role"] == "user"])
+    user_texts = [m["content"] for m in messages if m["role"] == "user"]
     question = data["question"]
     # 直近の質問がmessagesに含まれていない場合は追加
     if not messages or messages[-1]["content"] != question:
-        user_text += ("\n" if user_text else "") + question
-    query_vector = await get_embedding_with_cohere(user_text)
-    results = search_similar_syllabuses(query_vector, top_k=10)
-    context_parts = []
-    for row in results:
-        code = row["code"]
-        md = row["md"]
-        lecture_info = get_lecture_by_code(code)
-        if lecture_info:
-            lecture_details = f"""
-講義名: {lecture_info["name"] or "情報なし"}
-講師: {lecture_info["lecturer"] or "情報なし"}
-学年: {lecture_info["grade"] or "情報なし"}
-曜日・校時: {lecture_info["time"] or "情報なし"}
-"""
-        else:
-            lecture_details = "講義情報: 該当なし"
-        context_parts.append(f"{lecture_details}\n\nシラバス内容:\n{md}")
-    context = "\n\n---\n\n".join(context_parts)
+        user_texts.append(question)
+    mode = data.get("mode") or RAG_SEARCH_MODE
+    # キーワード検索は埋め込みを使わないので、発言を連結した文字列で検索する
+    query_vector = None
+    if mode != "keyword":
+        query_vector = await conversation_vector(user_texts)
+    results = await retrieve_syllabuses(
+        "\n".join(user_texts),
+        mode=mode,
+        top_k=10,
+        filters=data.get("filters"),
+        details=False,
+        query_vector=query_vector,
+    )
+    vector = await _answer_cache_vector(question, messages, data.get("mode"))
+    context, _ = await run_db(build_rag_context, results)
     prompt = f"# シラバス情報\n{context}\n\n# ユーザーの質問\n{question}"
-    answer = await generate_answer_with_ai(prompt, messages, fast=True)
-    for chunk in answer.split("。"):
-        if chunk.strip():
-            yield chunk + "。"
-            await asyncio.sleep(0.05)
+    async for chunk in _answer_with_cache(prompt, messages, vector, results):
+        yield chunk
 
 
-def bytes_to_float_list(byte_data: bytes) -> List[float]:
-    count = len(byte_data) // 4  # float32 = 4バイト
-    import struct
-
-    return list(struct.unpack(f"{count}f", byte_data))
-
-
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    import math
-
-    dot = sum(x * y for x, y in zip(a, b))
-    norm_a = math.sqrt(sum(x * x for x in a))
-    norm_b = math.sqrt(sum(y * y for y in b))
-    return dot / (norm_a * norm_b) if norm_a > 0 and norm_b > 0 else 0.0
+async def chat_service_stream(data):
+    async for chunk in inflight.stream(
+        _chat_key("chat_stream", data), lambda: _chat_stream_chunks(data)
+    ):
+        yield chunk
 
 
 def get_available_lectures_service(day: str, period: int):
@@ -429,10 +1110,4 @@ def get_available_lectures_service(day: str, period: int):
     day: "月", "火", ...
     period: 1, 2, ...
     """
-    hankaku = "0123456789"
-    zenkaku = "０１２３４５６７８９"
-    period_zenkaku = "".join(
-        zenkaku[hankaku.index(c)] if c in hankaku else c for c in str(period)
-    )
-    time_str = f"{day}{period_zenkaku}"
-    return get_lectures_service(time=time_str)
+    return get_lectures_by_slot(day, period)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import json
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from embedding_cache import normalize_query
+
+
+def request_key(namespace: str, payload: Any) -> str:
+    """正規化したリクエスト内容のハッシュ（文字列は normalize_query で表記ゆれを吸収）"""
+
+    def normalize(value):
+        if isinstance(value, str):
+            return normalize_query(value)
+        if isinstance(value, dict):
+            return {k: normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [normalize(v) for v in value]
+        return value
+
+    raw = json.dumps(normalize(payload), ensure_ascii=False, sort_keys=True)
+    return f"{namespace}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()}"
+
+
+class _Broadcast:
+    """1つの上流ストリームの出力を複数の購読者に配る"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+# ========================
+#  同一リクエストの合流（single-flight）
+# ========================
+class SingleFlight:
+    """同じキーの処理が実行中なら新たに実行せず、その結果を待って共有する
+
+    上流の処理はタスクとして実行するため、最初の呼び出し元が切断しても
+    合流した他の呼び出し元には結果が届く。プロセス内でのみ有効。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def _count(self, leader: bool):
+        with self._lock:
+            if leader:
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """fn() の結果を返す（同じキーで実行中なら、その結果・例外を共有）"""
+        task = self._calls.get(key)
+        if task is None:
+            self._count(leader=True)
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(self._calls, key, t))
+        else:
+            self._count(leader=False)
+        return await asyncio.shield(task)
+
+    async def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncIterator[str]:
+        """factory() が返すストリームを購読する（実行中なら途中から合流し、既出分も最初から受け取る）"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            self._count(leader=True)
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(self._pump(key, broadcast, factory))
+        else:
+            self._count(leader=False)
+
+        index = 0
+        while True:
+            changed = broadcast.changed
+            if index < len(broadcast.chunks):
+                chunk = broadcast.chunks[index]
+                index += 1
+                yield chunk
+            elif broadcast.done:
+                if broadcast.error is not None:
+                    raise broadcast.error
+                return
+            else:
+                await changed.wait()
+
+    async def _pump(
+        self,
+        key: str,
+        broadcast: _Broadcast,
+        factory: Callable[[], AsyncIterator[str]],
+    ):
+        try:
+            async for chunk in factory():
+                broadcast.chunks.append(chunk)
+                broadcast.notify()
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            broadcast.notify()
+            self._forget(self._streams, key, broadcast)
+
+    @staticmethod
+    def _forget(table: Dict, key: str, value):
+        if table.get(key) is value:
+            del table[key]
+
+    def stats(self) -> Dict[str, float]:
+        """合流の統計（followers = 上流を呼ばずに済んだリクエスト数）"""
+        total = self.leaders + self.followers
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "in_flight": len(self._calls) + len(self._streams),
+            "coalesce_rate": self.followers / total if total else 0.0,
+        }
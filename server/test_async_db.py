@@ -0,0 +1,53 @@
+import asyncio
+import time
+from async_db import run_db, shutdown_db_executor
+
+TICK = 0.01
+SLOW_CALL = 0.5
+
+
+async def _max_tick_gap(work) -> float:
+    """work() を実行している間、イベントループ上のタスクが動けなかった最長時間"""
+    gaps = []
+    done = False
+
+    async def ticker():
+        last = time.monotonic()
+        while not done:
+            await asyncio.sleep(TICK)
+            now = time.monotonic()
+            gaps.append(now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    try:
+        await work()
+    finally:
+        done = True
+        await task
+    return max(gaps)
+
+
+def test_run_db_keeps_event_loop_responsive():
+    async def slow_query():
+        await run_db(time.sleep, SLOW_CALL)
+
+    gap = asyncio.run(_max_tick_gap(slow_query))
+    assert gap < SLOW_CALL / 5
+
+
+def test_blocking_call_is_detected():
+    # 同じ計測でループ上の同期呼び出しは検出できること（上のテストの前提の確認）
+    async def blocking_query():
+        time.sleep(SLOW_CALL)
+
+    gap = asyncio.run(_max_tick_gap(blocking_query))
+    assert gap >= SLOW_CALL * 0.9
+
+
+def test_run_db_after_shutdown():
+    assert asyncio.run(run_db(sum, [1, 2])) == 3
+    shutdown_db_executor()
+    # アプリの終了後に同じプロセスで再び起動しても使えること
+    assert asyncio.run(run_db(sum, [3, 4])) == 7
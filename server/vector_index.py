@@ -0,0 +1,631 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+from database import get_db_connection, get_table_version
+
+# 索引ファイルの保存先
+INDEX_DIR = "./data"
+
+# 近似最近傍探索の設定
+# VECTOR_INDEX_BACKEND: "ivf"（近似）または "exact"（全件走査）
+ANN_BACKEND = os.getenv("VECTOR_INDEX_BACKEND", "ivf")
+# この件数未満のコーパスでは全件走査の方が速いので近似索引を作らない
+ANN_MIN_ROWS = int(os.getenv("VECTOR_INDEX_ANN_MIN_ROWS", "2000"))
+# 検索時に走査するクラスタ数（大きいほど再現率↑・速度↓）
+IVF_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+# 粗検索に使う量子化符号: "none" / "int8" / "binary"
+QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "none")
+# 粗検索で残す候補数 = top_k * RERANK_FACTOR（float32で再ランキング）
+RERANK_FACTOR = int(os.getenv("VECTOR_INDEX_RERANK_FACTOR", "10"))
+
+# 0〜255 の各バイトに含まれる1ビットの数（ハミング距離計算用）
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """スコア降順で上位k件のインデックスを返す"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(scores.shape[0])
+    return top[np.argsort(-scores[top])]
+
+
+# ========================
+#  IVF（転置ファイル）近似索引
+# ========================
+class IVFIndex:
+    """球面k-meansで行列をクラスタに分け、近いクラスタの行だけを走査する索引
+
+    order はクラスタ順に並べた行番号、offsets[c]:offsets[c+1] がクラスタcの範囲。
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        n_lists: Optional[int] = None,
+        n_iter: int = 10,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """正規化済み行列からクラスタを学習"""
+        n_rows = matrix.shape[0]
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(n_rows)))
+        n_lists = min(n_lists, n_rows)
+
+        rng = np.random.default_rng(seed)
+        centroids = matrix[rng.choice(n_rows, size=n_lists, replace=False)].copy()
+        assign = np.zeros(n_rows, dtype=np.int64)
+        for _ in range(n_iter):
+            assign = cls._assign(matrix, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, matrix)
+            counts = np.bincount(assign, minlength=n_lists)
+            # 空クラスタは前回の重心を維持
+            filled = counts > 0
+            centroids[filled] = sums[filled]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+        assign = cls._assign(matrix, centroids)
+
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=n_lists)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return cls(centroids.astype(np.float32), order.astype(np.int64), offsets)
+
+    @staticmethod
+    def _assign(
+        matrix: np.ndarray, centroids: np.ndarray, chunk: int = 8192
+    ) -> np.ndarray:
+        assign = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], chunk):
+            block = matrix[start : start + chunk]
+            assign[start : start + chunk] = np.argmax(block @ centroids.T, axis=1)
+        return assign
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """クエリに近い nprobe 個のクラスタに属する行番号を返す"""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        lists = _top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate(
+            [self.order[self.offsets[c] : self.offsets[c + 1]] for c in lists]
+        )
+
+    def save(self, path: str, fingerprint: str):
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            fingerprint=np.array(fingerprint),
+            centroids=self.centroids,
+            order=self.order,
+            offsets=self.offsets,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, fingerprint: str) -> Optional["IVFIndex"]:
+        """保存済み索引を読み込む（データと一致しない場合はNone）"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if str(data["fingerprint"]) != fingerprint:
+                    return None
+                return cls(data["centroids"], data["order"], data["offsets"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+# ========================
+#  量子化符号（int8 / 1ビット）
+# ========================
+class QuantizedCodes:
+    """正規化済み行列の int8 スカラー量子化符号と符号ビット(1bit)符号
+
+    int8 は次元ごとのスケールで [-127, 127] に量子化（float32の1/4）、
+    binary は各次元の符号のみを packbits で詰めたもの（float32の1/32）。
+    """
+
+    def __init__(self, int8: np.ndarray, scales: np.ndarray, bits: np.ndarray):
+        self.int8 = int8
+        self.scales = scales
+        self.bits = bits
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, chunk: int = 8192) -> "QuantizedCodes":
+        n_rows, dim = matrix.shape
+        scales = np.zeros(dim, dtype=np.float32)
+        for start in range(0, n_rows, chunk):
+            block_max = np.abs(matrix[start : start + chunk]).max(axis=0)
+            np.maximum(scales, block_max, out=scales)
+        scales /= 127.0
+        scales[scales == 0] = 1.0
+
+        int8 = np.empty((n_rows, dim), dtype=np.int8)
+        bits = np.empty((n_rows, (dim + 7) // 8), dtype=np.uint8)
+        for start in range(0, n_rows, chunk):
+            block = np.asarray(matrix[start : start + chunk])
+            int8[start : start + chunk] = np.clip(
+                np.rint(block / scales), -127, 127
+            ).astype(np.int8)
+            bits[start : start + chunk] = np.packbits(block > 0, axis=1)
+        return cls(int8, scales, bits)
+
+    @property
+    def nbytes(self) -> Dict[str, int]:
+        return {"int8": int(self.int8.nbytes), "binary": int(self.bits.nbytes)}
+
+    def scores(
+        self, query: np.ndarray, mode: str, rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """粗いスコアを返す（大きいほど近い）。rows 指定時はその行のみ"""
+        if mode == "int8":
+            # クエリ側にスケールを掛けてから int8 化し、int32 で内積を取る
+            scaled = query * self.scales
+            q_scale = np.abs(scaled).max() / 127.0 or 1.0
+            q8 = np.clip(np.rint(scaled / q_scale), -127, 127).astype(np.int8)
+            codes = self.int8 if rows is None else self.int8[rows]
+            return np.einsum("ij,j->i", codes, q8, dtype=np.int32)
+        if mode == "binary":
+            q_bits = np.packbits(query > 0)
+            codes = self.bits if rows is None else self.bits[rows]
+            hamming = _POPCOUNT8[np.bitwise_xor(codes, q_bits)].sum(
+                axis=1, dtype=np.int32
+            )
+            return -hamming
+        raise ValueError(f"未対応の量子化モード: {mode}")
+
+
+class _IndexSnapshot:
+    """索引の読み込み結果一式（検索中の不整合を防ぐため丸ごと差し替える）"""
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        codes: List[str],
+        matrix: np.ndarray,
+        ann: Optional[IVFIndex] = None,
+        quantized: Optional[QuantizedCodes] = None,
+    ):
+        self.ids = ids
+        self.codes = codes
+        self.matrix = matrix
+        self.ann = ann
+        self.quantized = quantized
+        self._code_rows: Optional[Dict[str, np.ndarray]] = None
+
+    def rows_for_codes(self, codes) -> np.ndarray:
+        """指定した科目コードを持つ行番号（昇順）"""
+        if self._code_rows is None:
+            code_rows: Dict[str, List[int]] = {}
+            for row, code in enumerate(self.codes):
+                code_rows.setdefault(code, []).append(row)
+            self._code_rows = {
+                code: np.asarray(rows, dtype=np.int64)
+                for code, rows in code_rows.items()
+            }
+        parts = [self._code_rows[c] for c in codes if c in self._code_rows]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+
+# ========================
+#  シラバスベクトル索引（常駐行列）
+# ========================
+class SyllabusVectorIndex:
+    """syllabusesテーブルの全ベクトルを正規化済みfloat32行列として保持する
+
+    行列は data/ 以下に書き出したファイルを np.memmap で読み取り専用に開くため、
+    複数ワーカーでも物理メモリ上のコピーは1つで済み、起動時のBLOB復元も不要。
+    検索は行列ベクトル積1回 + argpartition で上位k件を求める。
+    件数が ANN_MIN_ROWS 以上かつ backend="ivf" の場合はIVF索引で候補を絞る。
+    table_versions のバージョンが変わった場合は次回検索時に再読み込みする。
+    """
+
+    def __init__(
+        self,
+        table: str = "syllabuses",
+        backend: str = ANN_BACKEND,
+        quantization: str = QUANTIZATION,
+    ):
+        self.table = table
+        self.backend = backend
+        self.quantization = quantization
+        self._lock = threading.Lock()
+        self._version: Optional[int] = None
+        self._snapshot = _IndexSnapshot(
+            np.empty(0, dtype=np.int64), [], np.empty((0, 0), dtype=np.float32)
+        )
+
+    def __len__(self) -> int:
+        return len(self._snapshot.codes)
+
+    @property
+    def ann_path(self) -> str:
+        return os.path.join(INDEX_DIR, f"{self.table}_ivf.npz")
+
+    @property
+    def store_path(self) -> str:
+        return os.path.join(INDEX_DIR, f"{self.table}_vectors.f32")
+
+    @property
+    def sidecar_path(self) -> str:
+        return os.path.join(INDEX_DIR, f"{self.table}_vectors.json")
+
+    def _read_rows(self):
+        """DBからベクトルを読み込み、行ごとにL2正規化した行列を構築"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, code, vector FROM {self.table} WHERE vector IS NOT NULL ORDER BY id"
+            )
+            rows = cursor.fetchall()
+
+        ids = []
+        codes = []
+        vectors = []
+        for row_id, code, vector_bytes in rows:
+            vector = np.frombuffer(vector_bytes, dtype=np.float32)
+            if vectors and vector.shape != vectors[0].shape:
+                # 次元が異なる壊れた行は除外
+                continue
+            ids.append(row_id)
+            codes.append(code)
+            vectors.append(vector)
+
+        if vectors:
+            matrix = np.vstack(vectors).astype(np.float32, copy=False)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+        else:
+            matrix = np.empty((0, 0), dtype=np.float32)
+        return np.asarray(ids, dtype=np.int64), codes, matrix
+
+    def export(self, version: Optional[int] = None) -> int:
+        """正規化済みベクトルを連続したfloat32ファイルとid/codeのサイドカーに書き出す
+
+        書き出したファイルは np.memmap で読み取り専用に開かれ、
+        同じマシン上の全ワーカーでページキャッシュを共有する。
+        """
+        if version is None:
+            version = get_table_version(self.table)
+        ids, codes, matrix = self._read_rows()
+        self._write_store(ids, codes, matrix, version)
+        return len(codes)
+
+    def _write_store(
+        self, ids: np.ndarray, codes: List[str], matrix: np.ndarray, version: int
+    ):
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        # 書き込み途中のファイルを他ワーカーが開かないよう一時ファイル経由で置換
+        suffix = f".tmp{os.getpid()}"
+        np.ascontiguousarray(matrix, dtype=np.float32).tofile(self.store_path + suffix)
+        with open(self.sidecar_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": version,
+                    "count": int(matrix.shape[0]),
+                    "dim": int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+                    "ids": ids.tolist(),
+                    "codes": codes,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(self.store_path + suffix, self.store_path)
+        os.replace(self.sidecar_path + suffix, self.sidecar_path)
+
+    def _open_store(self, version: int):
+        """書き出し済みファイルをmemmapで開く（バージョン不一致ならNone）"""
+        try:
+            with open(self.sidecar_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["version"] != version or meta["count"] == 0:
+                return None
+            matrix = np.memmap(
+                self.store_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(meta["count"], meta["dim"]),
+            )
+        except (OSError, ValueError, KeyError):
+            return None
+        return np.asarray(meta["ids"], dtype=np.int64), meta["codes"], matrix
+
+    def _load(self, version: int):
+        """memmapファイルを優先して開き、古い場合はDBから再構築して書き出す"""
+        store = self._open_store(version)
+        if store is None:
+            ids, codes, matrix = self._read_rows()
+            if matrix.shape[0] > 0:
+                try:
+                    self._write_store(ids, codes, matrix, version)
+                    store = self._open_store(version)
+                except OSError:
+                    pass
+            if store is None:
+                store = (ids, codes, matrix)
+
+        ids, codes, matrix = store
+        quantized = None
+        if self.quantization != "none" and matrix.shape[0] > 0:
+            quantized = QuantizedCodes.from_matrix(matrix)
+        self._snapshot = _IndexSnapshot(
+            ids, codes, matrix, self._load_ann(ids, matrix, version), quantized
+        )
+
+    def _load_ann(
+        self, ids: np.ndarray, matrix: np.ndarray, version: int
+    ) -> Optional[IVFIndex]:
+        """近似索引をディスクから読み込み、無ければ構築して保存"""
+        if self.backend != "ivf" or matrix.shape[0] < ANN_MIN_ROWS:
+            return None
+        fingerprint = (
+            f"{version}:{matrix.shape[1]}:{hashlib.sha1(ids.tobytes()).hexdigest()}"
+        )
+        ann = IVFIndex.load(self.ann_path, fingerprint)
+        if ann is None:
+            ann = IVFIndex.build(matrix)
+            ann.save(self.ann_path, fingerprint)
+        return ann
+
+    def refresh(self, force: bool = False):
+        """テーブルが更新されていれば再読み込み"""
+        version = get_table_version(self.table)
+        if not force and version == self._version:
+            return
+        with self._lock:
+            if force or version != self._version:
+                self._load(version)
+                self._version = version
+
+    def search(
+        self,
+        query_vector,
+        top_k: int = 10,
+        nprobe: Optional[int] = None,
+        quantization: Optional[str] = None,
+        candidate_codes=None,
+    ) -> List[Dict]:
+        """コサイン類似度の高い順に上位k件の {id, code, similarity} を返す
+
+        nprobe: IVF索引で走査するクラスタ数（None で IVF_NPROBE）
+        quantization: 粗検索に使う符号 "int8" / "binary" / "none"
+            （None でインスタンスの設定）。粗検索で絞った候補を float32 で再ランキングする
+        candidate_codes: 指定時はこの科目コードの行のみを走査する
+        """
+        self.refresh()
+        snapshot = self._snapshot
+        matrix = snapshot.matrix
+        if matrix.shape[0] == 0 or top_k <= 0:
+            return []
+
+        rows = None
+        if candidate_codes is not None:
+            rows = snapshot.rows_for_codes(candidate_codes)
+            if rows.shape[0] == 0:
+                return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != matrix.shape[1]:
+            return []
+        query = query / norm
+
+        mode = quantization or self.quantization
+        if mode != "none" and snapshot.quantized is None:
+            # 量子化符号は初回要求時に作成して保持する
+            snapshot.quantized = QuantizedCodes.from_matrix(matrix)
+        top, top_scores = self._search_query(
+            query,
+            top_k,
+            nprobe,
+            mode,
+            matrix,
+            snapshot.ann,
+            snapshot.quantized,
+            rows,
+        )
+        return [
+            {
+                "id": int(snapshot.ids[i]),
+                "code": snapshot.codes[i],
+                "similarity": float(score),
+            }
+            for i, score in zip(top, top_scores)
+        ]
+
+    def search_batch(
+        self,
+        query_vectors,
+        top_k: int = 10,
+        candidate_codes=None,
+        block_size: int = 256,
+    ) -> List[List[Dict]]:
+        """複数クエリの上位k件を行列積でまとめて求める（常に全件の厳密計算）
+
+        query_vectors: (クエリ数, 次元) の配列。ゼロベクトルの行は空リストを返す
+        candidate_codes: 指定時はこの科目コードの行のみを走査する
+        block_size: 一度に計算するクエリ数（スコア行列 行数×block_size の上限）
+        """
+        self.refresh()
+        snapshot = self._snapshot
+        matrix = snapshot.matrix
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if queries.ndim != 2 or queries.shape[0] == 0:
+            return []
+        results: List[List[Dict]] = [[] for _ in range(queries.shape[0])]
+        if matrix.shape[0] == 0 or top_k <= 0 or queries.shape[1] != matrix.shape[1]:
+            return results
+
+        rows = None
+        if candidate_codes is not None:
+            rows = snapshot.rows_for_codes(candidate_codes)
+            if rows.shape[0] == 0:
+                return results
+        target = matrix if rows is None else matrix[rows]
+
+        norms = np.linalg.norm(queries, axis=1)
+        valid = np.flatnonzero(norms > 0)
+        queries = queries[valid] / norms[valid, None]
+        for start in range(0, valid.shape[0], block_size):
+            block = queries[start : start + block_size]
+            # (行数, クエリ数) のスコアを1回の行列積で計算
+            scores = target @ block.T
+            for j in range(block.shape[0]):
+                column = scores[:, j]
+                top = _top_k_indices(column, top_k)
+                top_rows = top if rows is None else rows[top]
+                results[valid[start + j]] = [
+                    {
+                        "id": int(snapshot.ids[i]),
+                        "code": snapshot.codes[i],
+                        "similarity": float(score),
+                    }
+                    for i, score in zip(top_rows, column[top])
+                ]
+        return results
+
+    def vectors_for_codes(self, codes: List[str]) -> Dict[str, np.ndarray]:
+        """科目コードごとの正規化済みベクトル（同じコードが複数行あれば先頭の行）"""
+        self.refresh()
+        snapshot = self._snapshot
+        vectors = {}
+        for code in codes:
+            rows = snapshot.rows_for_codes([code])
+            if rows.shape[0] > 0:
+                vectors[code] = np.asarray(snapshot.matrix[rows[0]])
+        return vectors
+
+    @staticmethod
+    def _search_query(
+        query: np.ndarray,
+        top_k: int,
+        nprobe: Optional[int],
+        mode: str,
+        matrix: np.ndarray,
+        ann: Optional[IVFIndex],
+        quantized: Optional[QuantizedCodes],
+        rows: Optional[np.ndarray] = None,
+    ):
+        """正規化済みクエリ1件の上位k件の (行番号, スコア) を返す
+
+        rows: 絞り込み済みの候補行（指定時はIVF索引を使わずこの範囲のみ走査）
+        """
+        if rows is None and ann is not None:
+            rows = ann.candidates(query, nprobe or IVF_NPROBE)
+            if rows.shape[0] < top_k:
+                # 候補が足りない場合は全件走査にフォールバック
+                rows = None
+
+        n_shortlist = top_k * RERANK_FACTOR
+        n_rows = matrix.shape[0] if rows is None else rows.shape[0]
+        if mode != "none" and quantized is not None and n_rows > n_shortlist:
+            # 量子化符号で候補を絞り、float32 で再ランキング
+            coarse = quantized.scores(query, mode, rows)
+            shortlist = _top_k_indices(coarse, n_shortlist)
+            rows = np.sort(shortlist if rows is None else rows[shortlist])
+
+        if rows is None:
+            scores = matrix @ query
+            top = _top_k_indices(scores, top_k)
+            return top, scores[top]
+        scores = matrix[rows] @ query
+        local = _top_k_indices(scores, top_k)
+        return rows[local], scores[local]
+
+    def evaluate_quantization(
+        self, n_queries: int = 200, top_k: int = 10, seed: int = 0
+    ) -> Dict[str, Dict[str, float]]:
+        """量子化による精度低下を全件走査との recall@k で計測する
+
+        クエリには登録済みベクトルにノイズを加えたものを使う。
+        """
+        self.refresh()
+        matrix = self._snapshot.matrix
+        if matrix.shape[0] == 0:
+            return {}
+        quantized = self._snapshot.quantized or QuantizedCodes.from_matrix(matrix)
+
+        rng = np.random.default_rng(seed)
+        picks = rng.choice(matrix.shape[0], size=min(n_queries, matrix.shape[0]))
+        queries = np.asarray(matrix[picks]) + rng.normal(
+            scale=0.5 / np.sqrt(matrix.shape[1]), size=(len(picks), matrix.shape[1])
+        ).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        report = {}
+        for mode in ("int8", "binary"):
+            coarse_hits = 0
+            rerank_hits = 0
+            for query in queries:
+                exact = set(_top_k_indices(matrix @ query, top_k).tolist())
+                coarse = _top_k_indices(quantized.scores(query, mode), top_k)
+                reranked, _ = self._search_query(
+                    query, top_k, None, mode, matrix, None, quantized
+                )
+                coarse_hits += len(exact & set(coarse.tolist()))
+                rerank_hits += len(exact & set(reranked.tolist()))
+            total = len(queries) * min(top_k, matrix.shape[0])
+            report[mode] = {
+                "recall_coarse": coarse_hits / total,
+                "recall_reranked": rerank_hits / total,
+                "bytes": quantized.nbytes[mode],
+                "compression": matrix.nbytes / quantized.nbytes[mode],
+            }
+        return report
+
+
+_syllabus_index = SyllabusVectorIndex()
+_chunk_index = SyllabusVectorIndex(table="syllabus_chunks")
+
+
+def get_syllabus_index() -> SyllabusVectorIndex:
+    """プロセス内で共有するシラバス索引を取得"""
+    return _syllabus_index
+
+
+def get_chunk_index() -> SyllabusVectorIndex:
+    """プロセス内で共有するシラバスチャンク索引を取得"""
+    return _chunk_index
+
+
+if __name__ == "__main__":
+    # python vector_index.py export : ベクトルをmemmap用ファイルに書き出す
+    # python vector_index.py quantization-report : 量子化の精度低下を表示
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "export":
+        count = get_syllabus_index().export()
+        print(f"{count}件のベクトルを書き出しました")
+        count = get_chunk_index().export()
+        print(f"{count}件のチャンクベクトルを書き出しました")
+    elif command == "quantization-report":
+        report = get_syllabus_index().evaluate_quantization()
+        for mode, stats in report.items():
+            print(
+                f"{mode}: recall@10 粗検索={stats['recall_coarse']:.3f} "
+                f"再ランキング後={stats['recall_reranked']:.3f} "
+                f"サイズ={stats['bytes']}バイト ({stats['compression']:.0f}分の1)"
+            )
+    else:
+        print("usage: python vector_index.py export | quantization-report")